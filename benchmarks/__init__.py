@@ -0,0 +1,15 @@
+""" Performance benchmarks for metafunc
+
+Run all benchmarks and write the results as JSON with:
+
+    python -m benchmarks --output results.json
+
+Use ``--quick`` for a fast smoke run and ``--compare old.json`` to print
+the relative change of every measurement against an earlier run.
+"""
+import os
+import sys
+
+# the small namespaces are the ``zmm`` fixtures of the tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'metafunc', 'tests'))
@@ -0,0 +1,74 @@
+""" Run the benchmarks and write machine-readable results"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+
+import metafunc
+
+from . import bench_call, bench_import, bench_mutation
+
+groups = {
+    'import': bench_import,
+    'call': bench_call,
+    'mutation': bench_mutation,
+}
+
+
+def _key(record):
+    return (record['group'], record['name'],
+            tuple(sorted(record['params'].items())))
+
+
+def compare(old, new, out=sys.stdout):
+    """ Print the ratio of new to old seconds for matching results"""
+    previous = dict((_key(record), record) for record in old['results'])
+    for record in new['results']:
+        prev = previous.get(_key(record))
+        if prev is None or 'seconds' not in record or not prev.get('seconds'):
+            continue
+        params = ', '.join('%s=%s' % item
+                           for item in sorted(record['params'].items()))
+        out.write('%-10s %-20s %-45s %6.2fx\n' % (
+            record['group'], record['name'], params,
+            record['seconds'] / prev['seconds']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description=__doc__)
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help='fewer and shorter runs')
+    parser.add_argument('-g', '--group', action='append',
+                        choices=sorted(groups), help='only run these groups')
+    parser.add_argument('-c', '--compare',
+                        help='JSON results of an earlier run to compare to')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.group or sorted(groups):
+        results.extend(groups[name].run(quick=args.quick))
+    data = {
+        'metafunc_version': metafunc.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'quick': args.quick,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+    else:
+        json.dump(data, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+""" Per-call overhead of chains compared to hand-written equivalents"""
+import itertools
+import sys
+
+from metafunc import declare, evaluate
+
+from .fixtures import (double, doubled, hof_fofs, hof_hofs, hofs, fofs,
+                       identity, inc, incremented, newroot, synthetic_hofs,
+                       synthetic_stages, tripled, triple)
+from .timing import result, timeit
+
+
+def bench_composition(quick=False):
+    number = 10000 if quick else 1000000
+    results = []
+
+    def hand(x):
+        return double(inc(triple(double(inc(identity(x))))))
+    seconds = timeit(lambda: hand(1), number=number)
+    results.append(result('call', 'composition', seconds, impl='hand',
+                          depth=5))
+    for compiled in (False, True):
+        root = newroot(hofs, fofs, composition=True, lazy=True,
+                       compiled=compiled)
+        func = sys.modules[root].inc.double.triple.inc.double.identity
+        assert func(1) == hand(1)
+        seconds = timeit(lambda: func(1), number=number)
+        impl = 'compiled' if compiled else 'closure'
+        results.append(result('call', 'composition', seconds, impl=impl,
+                              depth=5))
+    depths = [1, 10] if quick else [1, 2, 5, 10, 20]
+    for depth in depths:
+        stages = synthetic_stages(depth)
+        for compiled in (False, True):
+            root = newroot(stages, [identity], composition=True, lazy=True,
+                           compiled=compiled)
+            module = sys.modules[root]
+            for stage in stages:
+                module = getattr(module, stage.__name__)
+            func = module.identity
+            seconds = timeit(lambda: func(1), number=number)
+            impl = 'compiled' if compiled else 'closure'
+            results.append(result('call', 'composition_depth', seconds,
+                                  impl=impl, depth=depth))
+    return results
+
+
+def bench_hof(quick=False):
+    number = 10000 if quick else 1000000
+    results = []
+    hand = incremented(tripled(doubled(identity)))
+    seconds = timeit(lambda: hand(1), number=number)
+    results.append(result('call', 'hof', seconds, impl='hand', depth=3))
+    root = newroot(hof_hofs, hof_fofs, lazy=True)
+    func = sys.modules[root].doubled.tripled.incremented.identity
+    assert func(1) == hand(1)
+    seconds = timeit(lambda: func(1), number=number)
+    results.append(result('call', 'hof', seconds, impl='chain', depth=3))
+    seconds = timeit(lambda: identity(1), number=number)
+    results.append(result('call', 'hof', seconds, impl='bare', depth=0))
+    depths = [1, 10] if quick else [1, 2, 5, 10, 20]
+    for depth in depths:
+        decorators = synthetic_hofs(depth)
+        root = newroot(decorators, [identity], lazy=True)
+        module = sys.modules[root]
+        for decorator in decorators:
+            module = getattr(module, decorator.__name__)
+        func = module.identity
+        seconds = timeit(lambda: func(1), number=number)
+        results.append(result('call', 'hof_depth', seconds, impl='chain',
+                              depth=depth))
+        # the same decorators declared with their result transform
+        decorators = [declare(decorator, result=lambda x: 2 * x)
+                      for decorator in decorators]
+        root = newroot(decorators, [identity], lazy=True)
+        module = sys.modules[root]
+        for decorator in decorators:
+            module = getattr(module, decorator.__name__)
+        func = module.identity
+        assert func(1) == 2 ** depth
+        seconds = timeit(lambda: func(1), number=number)
+        results.append(result('call', 'hof_depth', seconds, impl='flattened',
+                              depth=depth))
+    return results
+
+
+def bench_evaluate(quick=False):
+    """ Many chains with shared prefixes, called separately or together"""
+    number = 10 if quick else 1000
+    results = []
+    stages = synthetic_stages(4)
+    root = newroot(stages, [identity], composition=True, lazy=True)
+    names = [stage.__name__ for stage in stages]
+    for depth in [2, 3] if quick else [2, 3, 4]:
+        paths = ['.'.join(p + ('identity',))
+                 for p in itertools.product(names, repeat=depth)]
+        funcs = []
+        for path in paths:
+            module = sys.modules[root]
+            for name in path.split('.')[:-1]:
+                module = getattr(module, name)
+            funcs.append(module.identity)
+        seconds = timeit(lambda: [func(1) for func in funcs], number=number)
+        results.append(result('call', 'evaluate', seconds, impl='separate',
+                              depth=depth, chains=len(paths)))
+        seconds = timeit(lambda: evaluate(root, paths, 1), number=number)
+        results.append(result('call', 'evaluate', seconds, impl='shared',
+                              depth=depth, chains=len(paths)))
+    return results
+
+
+def run(quick=False):
+    return bench_composition(quick) + bench_hof(quick) + bench_evaluate(quick)
@@ -0,0 +1,129 @@
+""" Import latency, memory per module and ``sys.meta_path`` growth"""
+import itertools
+import sys
+import tracemalloc
+
+from metafunc import chaincache, metafunc, resolve, Template
+
+from .fixtures import newname, newroot, synthetic_funcs, synthetic_stages
+from .timing import once, result, timeit
+
+
+def import_chain(path, name):
+    """ Equivalent to ``from path import name``"""
+    return getattr(__import__(path, fromlist=[name]), name)
+
+
+def chain_path(root, stages, depth):
+    names = itertools.islice(itertools.cycle(s.__name__ for s in stages),
+                             depth)
+    return '.'.join(itertools.chain([root], names))
+
+
+def bench_import(quick=False):
+    results = []
+    depths = [1, 4, 16] if quick else [1, 2, 4, 8, 16, 32]
+    sizes = [10, 100] if quick else [10, 100, 1000]
+    number = 100 if quick else 10000
+    stages = synthetic_stages(4)
+    for lazy in (False, True):
+        for nfuncs in sizes:
+            funcs = synthetic_funcs(nfuncs)
+            for depth in depths:
+                root = newroot(stages, funcs, composition=True, lazy=lazy)
+                path = chain_path(root, stages, depth)
+                chaincache.clear()
+                params = dict(depth=depth, funcs=nfuncs, lazy=lazy)
+                seconds = once(lambda: import_chain(path, 'f0'))
+                results.append(result('import', 'cold', seconds, **params))
+                seconds = timeit(lambda: import_chain(path, 'f0'),
+                                 number=number)
+                results.append(result('import', 'warm', seconds, **params))
+    return results
+
+
+def bench_meta_path(quick=False):
+    stages = synthetic_stages(4)
+    funcs = synthetic_funcs(10)
+    nroots = 10 if quick else 100
+    before = len(sys.meta_path)
+    modules = 0
+    for _ in range(nroots):
+        root = newroot(stages, funcs, composition=True, lazy=True)
+        for depth in range(1, 9):
+            import_chain(chain_path(root, stages, depth), 'f0')
+            modules += 1
+    return [result('meta_path', 'growth', finders_before=before,
+                   finders_after=len(sys.meta_path), roots=nroots,
+                   modules=modules)]
+
+
+def bench_memory(quick=False):
+    """ Resident bytes per chain module of a wide tree"""
+    stages = synthetic_stages(4)
+    funcs = synthetic_funcs(10)
+    depth = 4 if quick else 6
+    root = sys.modules[newroot(stages, funcs, composition=True, lazy=True)]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for path in itertools.product([s.__name__ for s in stages[:3]],
+                                      repeat=depth):
+            module = root
+            for name in path:
+                module = getattr(module, name)
+        modules = sum(1 for node in root._node.walk()) - 1
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return [result('memory', 'per_module', modules=modules,
+                   bytes=(after - before) // modules)]
+
+
+def bench_resolve(quick=False):
+    """ Looking up a chain function by path: import and getattr vs resolve"""
+    number = 1000 if quick else 100000
+    results = []
+    stages = synthetic_stages(4)
+    root = newroot(stages, synthetic_funcs(10), composition=True, lazy=True)
+    for depth in [1, 4] if quick else [1, 4, 16]:
+        for name, lookup in [('import', lambda p: import_chain(p, 'f0')),
+                             ('resolve', lambda p: resolve(p + '.f0'))]:
+            cold = newroot(stages, synthetic_funcs(10), composition=True,
+                           lazy=True)
+            path = chain_path(cold, stages, depth)
+            seconds = once(lambda: lookup(path))
+            results.append(result('resolve', name + '_cold', seconds,
+                                  depth=depth))
+        path = chain_path(root, stages, depth)
+        seconds = timeit(lambda: import_chain(path, 'f0'), number=number)
+        results.append(result('resolve', 'import', seconds, depth=depth))
+        seconds = timeit(lambda: resolve(path + '.f0'), number=number)
+        results.append(result('resolve', 'resolve', seconds, depth=depth))
+    return results
+
+
+def bench_template(quick=False):
+    """ Creating roots that share a namespace, with and without a Template"""
+    number = 100 if quick else 1000
+    stages = synthetic_stages(4)
+    funcs = synthetic_funcs(500)
+    template = Template(stages, funcs, composition=True)
+    override = [('f0', funcs[1])]
+    results = []
+    seconds = timeit(lambda: metafunc(newname(), stages, funcs,
+                                      composition=True, lazy=True),
+                     number=number)
+    results.append(result('root', 'create', seconds, impl='metafunc',
+                          funcs=len(funcs)))
+    seconds = timeit(lambda: template.instantiate(newname(),
+                                                  funcs=override),
+                     number=number)
+    results.append(result('root', 'create', seconds, impl='template',
+                          funcs=len(funcs)))
+    return results
+
+
+def run(quick=False):
+    return (bench_import(quick) + bench_memory(quick) + bench_resolve(quick) +
+            bench_meta_path(quick) + bench_template(quick))
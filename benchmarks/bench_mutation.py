@@ -0,0 +1,46 @@
+""" Cost of ``addfuncs`` and ``addmetafuncs`` on a populated tree"""
+import sys
+
+from metafunc import addfuncs, addmetafuncs
+
+from .fixtures import newname, newroot, synthetic_funcs, synthetic_stages
+from .timing import once, result
+
+
+def populate(root, stages, depth):
+    """ Materialize every chain of ``stages`` up to ``depth``"""
+    modules = [sys.modules[root]]
+    count = 0
+    for _ in range(depth):
+        children = []
+        for module in modules:
+            for stage in stages:
+                children.append(getattr(module, stage.__name__))
+        count += len(children)
+        modules = children
+    return count
+
+
+def run(quick=False):
+    results = []
+    sizes = [10] if quick else [10, 100]
+    widths = [3] if quick else [3, 6]
+    for lazy in (False, True):
+        for nfuncs in sizes:
+            for width in widths:
+                stages = synthetic_stages(width)
+                root = newroot(stages, synthetic_funcs(nfuncs),
+                               composition=True, lazy=lazy)
+                nodes = populate(root, stages, 3)
+                params = dict(funcs=nfuncs, nodes=nodes, lazy=lazy)
+                new = synthetic_funcs(nfuncs + 10)[nfuncs:]
+                seconds = once(lambda: addfuncs(root, new))
+                results.append(result('mutation', 'addfuncs', seconds,
+                                      added=len(new), **params))
+                new = synthetic_stages(width + 5)[width:]
+                for stage in new:
+                    stage.__name__ = newname('m')
+                seconds = once(lambda: addmetafuncs(root, new))
+                results.append(result('mutation', 'addmetafuncs', seconds,
+                                      added=len(new), **params))
+    return results
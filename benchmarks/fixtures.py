@@ -0,0 +1,64 @@
+""" Namespaces used by the benchmarks
+
+The small namespaces are the ``zmm`` fixtures used by the tests, and the
+large namespaces are generated with any number of functions.
+"""
+import itertools
+
+from metafunc import metafunc
+from zmm.firstorder import one, two, three, inc, double, triple, identity
+from zmm.higherorder import incremented, doubled, tripled, identified
+
+fofs = [one, two, three, identity]
+hofs = [inc, double, triple]
+hof_fofs = [one, two, three, identity, inc, double, triple]
+hof_hofs = [incremented, doubled, tripled, identified]
+
+_counter = itertools.count()
+
+
+def newname(prefix='mfbench'):
+    """ Return a module name that hasn't been used yet"""
+    return '%s%d' % (prefix, next(_counter))
+
+
+def synthetic_funcs(n):
+    """ Return ``n`` distinct first order functions ``f0 ... f{n-1}``"""
+    funcs = []
+    for i in range(n):
+        def func(x=i):
+            return x
+        func.__name__ = 'f%d' % i
+        funcs.append(func)
+    return funcs
+
+
+def synthetic_stages(n):
+    """ Return ``n`` distinct cheap composition stages ``s0 ... s{n-1}``"""
+    stages = []
+    for i in range(n):
+        def stage(x):
+            return x + 1
+        stage.__name__ = 's%d' % i
+        stages.append(stage)
+    return stages
+
+
+def synthetic_hofs(n):
+    """ Return ``n`` distinct result-doubling decorators ``h0 ... h{n-1}``"""
+    decorators = []
+    for i in range(n):
+        def decorator(f):
+            def inner(*args, **kwargs):
+                return 2 * f(*args, **kwargs)
+            return inner
+        decorator.__name__ = 'h%d' % i
+        decorators.append(decorator)
+    return decorators
+
+
+def newroot(metafuncs, funcs, **kwargs):
+    """ Create a root module with a fresh name and return its name"""
+    name = newname()
+    metafunc(name, metafuncs, funcs, **kwargs)
+    return name
@@ -0,0 +1,46 @@
+""" Helpers to time code and record results"""
+import gc
+import time
+
+try:
+    clock = time.perf_counter
+except AttributeError:  # pragma: no cover
+    clock = time.time
+
+
+def timeit(func, number=1, repeat=3):
+    """ Return the best time in seconds per call of ``func``
+
+    ``func`` is called ``number`` times per repeat with garbage collection
+    disabled, and the fastest of ``repeat`` repeats is used.
+    """
+    best = None
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = clock()
+            for _ in range(number):
+                func()
+            elapsed = (clock() - start) / number
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if enabled:
+            gc.enable()
+    return best
+
+
+def once(func):
+    """ Return the time in seconds of a single call of ``func``"""
+    start = clock()
+    func()
+    return clock() - start
+
+
+def result(group, name, seconds=None, **params):
+    """ Return a result record as written to the JSON output"""
+    rv = {'group': group, 'name': name, 'params': params}
+    if seconds is not None:
+        rv['seconds'] = seconds
+    return rv
@@ -1,5 +1,9 @@
-from .core import metafunc, addfuncs, addmetafuncs
+from .core import (metafunc, addfuncs, addmetafuncs, chaincache, evaluate,
+                   evaluator, prefetch, resolve, unload, Template)
+from .declare import declare
 
-__all__ = ['metafunc', 'addfuncs', 'addmetafuncs']
+__all__ = ['metafunc', 'addfuncs', 'addmetafuncs', 'chaincache', 'declare',
+           'evaluate', 'evaluator', 'prefetch', 'resolve', 'unload',
+           'Template']
 
 __version__ = '0.0.1'
@@ -0,0 +1,241 @@
+""" Generate an ordinary package from the chains of a MetaModule
+
+Creating a root with ``metafunc`` installs an import hook, and every chain
+module and function is built when it is first imported.  For command line
+tools and short-lived workers, the chains can instead be written ahead of
+time as a plain package:
+
+>>> generate('zmm.comp', 'build', depth=2)  # doctest: +SKIP
+'build/comp'
+
+after which ``from comp.inc.double import one`` is an ordinary import of
+straight-line code (compiled to .pyc like any other module), and the
+metafunc machinery isn't used at all.
+
+The first order functions and metafuncs are imported by the generated code,
+so they must be defined at module level where ``__module__`` and
+``__qualname__`` say.  Chains are simplified as usual by declared
+properties, unless a stage this creates (such as a fused stage) can't be
+imported, in which case the chain is generated unsimplified.  The
+generated functions are never instrumented.
+"""
+import ast
+import compileall
+import importlib
+import itertools
+import os
+import sys
+
+from .compiler import (_awaited, _nested, _parameters, _prefix, _streamed,
+                       iscoroutinefunction)
+from .core import MetaModule, _chainpaths, _missing
+from .declare import blocking, outermost, streamkinds, unwrap
+
+_header = '''""" Generated from %s by metafunc.aot; do not edit"""
+'''
+
+
+def _reference(obj):
+    """ Return ``(module, qualname)`` to import ``obj`` from, or None"""
+    module_name = getattr(obj, '__module__', None)
+    qualname = (getattr(obj, '__qualname__', None) or
+                getattr(obj, '__name__', None))
+    if not module_name or not qualname or '<' in qualname:
+        return None
+    try:
+        val = importlib.import_module(module_name)
+    except ImportError:
+        return None
+    for name in qualname.split('.'):
+        val = getattr(val, name, _missing)
+    if val is not obj:
+        return None
+    return module_name, qualname
+
+
+def _literal(value):
+    # the source of a default value, or None if it can't be reproduced
+    try:
+        source = repr(value)
+        if ast.literal_eval(source) == value:
+            return source
+    except (SyntaxError, TypeError, ValueError):
+        pass
+    return None
+
+
+def _signature(func):
+    """ Return parameter and argument source for a function calling ``func``"""
+    generic = ['*%sargs' % _prefix, '**%skwargs' % _prefix]
+    parameters = _parameters(func)
+    if parameters is None:
+        return generic, generic
+    params, args, namespace = parameters
+    rv = []
+    for param in params:
+        name, eq, default = param.partition('=')
+        if eq:
+            default = _literal(namespace[default])
+            if default is None:
+                return generic, generic
+            param = '%s=%s' % (name, default)
+        rv.append(param)
+    return rv, args
+
+
+class _Source(object):
+    """ The source of one generated module"""
+    def __init__(self, name):
+        self.imports = []
+        self.lines = []
+        self.names = {}
+        self.all = []
+        self.uses = set()
+        self.header = _header % name
+
+    def ref(self, obj):
+        """ Return the name the generated module refers to ``obj`` by"""
+        key = id(obj)
+        if key not in self.names:
+            module_name, qualname = _reference(obj)
+            alias = '%sr%d' % (_prefix, len(self.names))
+            first, dot, rest = qualname.partition('.')
+            self.imports.append('from %s import %s as %s'
+                                % (module_name, first, alias))
+            if rest:
+                self.imports.append('%s = %s.%s' % (alias, alias, rest))
+            self.names[key] = alias
+        return self.names[key]
+
+    def define(self, name, func, stages, composition, streaming):
+        """ Add the definition of the chain function ``name``"""
+        self.all.append(name)
+        ref = self.ref(unwrap(func))
+        # outer stages decorate the chain of the others, as at runtime
+        stages, outer = outermost(stages)
+        outernames = [self.ref(unwrap(stage)) for stage in outer]
+        names = [self.ref(unwrap(stage)) for stage in stages]
+        if not composition:
+            self.lines.append('%s = %s' % (name, _nested(ref, names +
+                                                         outernames)))
+            return
+        params, args = _signature(unwrap(func))
+        call = '%s(%s)' % (ref, ', '.join(args))
+        funcs = [unwrap(stage) for stage in stages]
+        keyword = 'def'
+        if streaming:
+            self.uses.add('stream')
+            expr = _streamed(call, names, streamkinds(stages))
+        elif any(map(iscoroutinefunction, [unwrap(func)] + funcs)):
+            executors = {}
+            for i, executor in blocking(stages).items():
+                if executor is not None:
+                    raise ValueError('Chain %r of %r runs a stage in an '
+                                     'executor, which can only be generated '
+                                     'for the default executor'
+                                     % (name, stages))
+                executors[i] = 'None'
+            expr = _awaited(call, iscoroutinefunction(unwrap(func)), names,
+                            list(map(iscoroutinefunction, funcs)), executors)
+            keyword = 'async def'
+            if executors:
+                self.uses.add('loop')
+        else:
+            expr = _nested(call, names)
+        self.lines.append('\n\n%s %s(%s):\n    return %s'
+                          % (keyword, name, ', '.join(params), expr))
+        if outernames:
+            self.lines.append('%s = %s' % (name, _nested(name, outernames)))
+
+    def __str__(self):
+        lines = [self.header]
+        lines.extend(sorted(set(self.imports), key=self.imports.index))
+        if 'stream' in self.uses:
+            lines.append('%smap = map' % _prefix)
+            lines.append('%sfilter = filter' % _prefix)
+            lines.append('%siter = iter' % _prefix)
+        if 'loop' in self.uses:
+            lines.append('from asyncio import get_running_loop as %sloop'
+                         % _prefix)
+        lines.append('')
+        lines.append('__all__ = %r' % (sorted(self.all),))
+        if self.lines and not self.lines[0].startswith('\n'):
+            lines.append('')
+        lines.extend(self.lines)
+        return '\n'.join(lines) + '\n'
+
+
+def _getroot(module_name):
+    module_name = getattr(module_name, '__name__', module_name)
+    module = sys.modules.get(module_name)
+    module = getattr(module, '_hidden_metamodule_', module)
+    if not isinstance(module, MetaModule) or module._root is not module:
+        raise ValueError('%r is not a root created by "metafunc"'
+                         % (module_name,))
+    return module
+
+
+def _chainstages(node, reverse):
+    # the simplified stages if they can be imported, else the original ones
+    chain = node.getchain(reverse)
+    if all(_reference(unwrap(stage)) is not None for stage in chain):
+        return chain
+    if reverse:
+        return node.stages[::-1]
+    return node.stages
+
+
+def _write(filename, source):
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(filename, 'w') as f:
+        f.write(source)
+
+
+def generate(module_name, directory, paths=None, depth=None, package=None,
+             compile=True):
+    """ Write chains of a root MetaModule as an ordinary package
+
+    Arguments:
+    module_name -- the name (or module object) of a root created by metafunc
+    directory -- where the package directory is created
+
+    Keyword Arguments:
+    paths -- chains to generate, such as "inc.double", ["inc", "double"]
+             or the glob pattern "inc.*"
+    depth -- also generate every chain of up to this many metafuncs
+    package -- name of the generated package (default is the last part of
+               ``module_name``)
+    compile (default True) -- compile the generated modules to .pyc
+
+    Returns the directory of the generated package.  Raises ValueError if a
+    first order function or metafunc can't be imported by name.
+    """
+    root = _getroot(module_name)
+    if package is None:
+        package = root.__name__.rpartition('.')[2]
+    for func in itertools.chain(root._funcs.values(),
+                                root._metafuncs.values()):
+        if _reference(unwrap(func)) is None:
+            raise ValueError('%r must be importable from its module to be '
+                             'generated' % (func,))
+    rootdir = os.path.join(directory, package)
+    sources = {(): _Source(root.__name__)}
+    for funcname, func in sorted(root._funcs.items()):
+        sources[()].define(funcname, func, (), False, False)
+    for path in _chainpaths(root, paths, depth):
+        # walk the trie, so no modules are created
+        node = root._node
+        for name in path:
+            node = node.child(name, root._metafuncs[name])
+        chain = _chainstages(node, root._reverse)
+        source = sources[path] = _Source('.'.join((root.__name__,) + path))
+        for funcname, func in sorted(root._funcs.items()):
+            source.define(funcname, func, chain, root._composition,
+                          root._streaming)
+    for path, source in sources.items():
+        _write(os.path.join(rootdir, *(path + ('__init__.py',))), str(source))
+    if compile:
+        compileall.compile_dir(rootdir, quiet=1)
+    return rootdir
@@ -0,0 +1,60 @@
+""" Run composition chains over a whole batch of values at once
+
+The functions of a composition chain have a ``batch`` attribute:
+
+>>> from comp.inc.double import identity
+>>> identity.batch([1, 2, 3])  # doctest: +SKIP
+[4, 6, 8]
+
+Instead of calling the chain once per value, each stage is run over the
+full batch before the next stage begins.  Stages (and first order
+functions) declared with ``declare(func, vectorize=True)`` are called once
+with the whole batch as a NumPy array, and other stages are called once
+per item in a tight loop.  NumPy is optional; without it, every stage is
+called per item.  Chains with ``outer`` stages have no ``batch``
+attribute, because it would bypass those stages.
+"""
+from .declare import getprops, unwrap
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def _vectorized(func):
+    return numpy is not None and getprops(func).get('vectorize', False)
+
+
+def batchcall(func, stages, values, *args, **kwargs):
+    """ Apply ``func`` and then each of ``stages`` to every item of ``values``
+
+    Each item is the first argument of ``func``, and ``args`` and ``kwargs``
+    are passed to every call of ``func``.  Returns a NumPy array if
+    ``values`` is a NumPy array, and a list otherwise.
+    """
+    isarray = numpy is not None and isinstance(values, numpy.ndarray)
+    if _vectorized(func):
+        rv = unwrap(func)(numpy.asarray(values), *args, **kwargs)
+    else:
+        func = unwrap(func)
+        rv = [func(value, *args, **kwargs) for value in values]
+    for stage in stages:
+        if _vectorized(stage):
+            rv = unwrap(stage)(numpy.asarray(rv))
+        else:
+            stage = unwrap(stage)
+            rv = [stage(value) for value in rv]
+    if isarray:
+        return numpy.asarray(rv)
+    if numpy is not None and isinstance(rv, numpy.ndarray):
+        return rv.tolist()
+    return list(rv)
+
+
+def makebatch(func, stages):
+    """ Return a function that calls ``batchcall`` for a chain"""
+    def batch(values, *args, **kwargs):
+        return batchcall(func, stages, values, *args, **kwargs)
+    batch.__name__ = getattr(func, '__name__', 'batch')
+    return batch
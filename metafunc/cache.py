@@ -0,0 +1,100 @@
+""" Bounded caches used to share chain functions"""
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+try:
+    _monotonic = time.monotonic
+except AttributeError:  # pragma: no cover
+    _monotonic = time.time
+
+
+class LRUCache(object):
+    """ A thread-safe mapping that holds at most ``maxsize`` items
+
+    When full, the least recently used item is evicted.  If ``maxsize`` is
+    None the cache is unbounded, and if it is 0 nothing is cached.  If
+    ``ttl`` is given, items also expire that many seconds after being set.
+    """
+    def __init__(self, maxsize=128, ttl=None, clock=_monotonic):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if self._ttl is not None:
+                if value[1] <= self._clock():
+                    self.misses += 1
+                    return default
+                self._data[key] = value
+                self.hits += 1
+                return value[0]
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            if self._ttl is not None:
+                value = (value, self._clock() + self._ttl)
+            self._data[key] = value
+            self._evict()
+
+    def __contains__(self, key):
+        if self._ttl is None:
+            return key in self._data
+        value = self._data.get(key)
+        return value is not None and value[1] > self._clock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict(self):
+        if self._maxsize is not None:
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize):
+        """ Change the maximum size, evicting items if necessary"""
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
+
+    def discard(self, predicate):
+        """ Remove every item whose key satisfies ``predicate(key)``"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        """ Remove all items and reset the statistics"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """ Return a CacheInfo of (hits, misses, maxsize, currsize)"""
+        return CacheInfo(self.hits, self.misses, self._maxsize,
+                         len(self._data))
@@ -0,0 +1,304 @@
+""" Generate straight-line functions for composition chains
+
+Rather than looping over the stages of a chain upon every call, a function
+such as ``def one(x, y=_mf_d0): return _mf_s1(_mf_s0(_mf_f(x, y)))`` is
+compiled once per chain.  It has the same signature as the first order
+function, so no ``*args`` and ``**kwargs`` packing is needed either.
+"""
+import inspect
+
+try:
+    from itertools import imap as _map, ifilter as _filter
+except ImportError:
+    _map = map
+    _filter = filter
+
+# Prefix of every name the generated code uses from its namespace
+_prefix = '_mf_'
+
+
+def _parameters(func):
+    """ Return parameter and argument source for calling ``func``
+
+    Returns a tuple of ``(params, args, namespace)`` where ``params`` is a
+    list of parameters for a ``def`` statement, ``args`` is a list of
+    arguments that forwards them to ``func``, and ``namespace`` holds the
+    default values referenced by ``params``.  Returns None if the signature
+    of ``func`` can't be inspected or reproduced.
+    """
+    try:
+        signature = inspect.signature(func)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    params = []
+    args = []
+    namespace = {}
+    positional_only = False
+    star = False
+    for param in signature.parameters.values():
+        name = param.name
+        if name.startswith(_prefix):
+            return None
+        kind = param.kind
+        if positional_only and kind is not param.POSITIONAL_ONLY:
+            params.append('/')
+            positional_only = False
+        if kind is param.VAR_POSITIONAL:
+            params.append('*' + name)
+            args.append('*' + name)
+            star = True
+            continue
+        if kind is param.VAR_KEYWORD:
+            params.append('**' + name)
+            args.append('**' + name)
+            continue
+        if kind is param.POSITIONAL_ONLY:
+            positional_only = True
+        elif kind is param.KEYWORD_ONLY and not star:
+            params.append('*')
+            star = True
+        if param.default is param.empty:
+            params.append(name)
+        else:
+            default = '%sd%d' % (_prefix, len(namespace))
+            namespace[default] = param.default
+            params.append('%s=%s' % (name, default))
+        if kind is param.KEYWORD_ONLY:
+            args.append('%s=%s' % (name, name))
+        else:
+            args.append(name)
+    if positional_only:
+        params.append('/')
+    return params, args, namespace
+
+
+def iscoroutinefunction(func):
+    """ Return True if ``func`` is a coroutine function (``async def``)"""
+    check = getattr(inspect, 'iscoroutinefunction', None)
+    return check is not None and check(func)
+
+
+def _stagenames(stages, namespace):
+    names = []
+    for i, stage in enumerate(stages):
+        names.append('%ss%d' % (_prefix, i))
+        namespace[names[-1]] = stage
+    return names
+
+
+def _define(source, namespace, func):
+    try:
+        code = compile(source, '<metafunc>', 'exec')
+    except SyntaxError:  # pragma: no cover
+        return None
+    exec(code, namespace)
+    rv = namespace[_prefix + 'chain']
+    name = getattr(func, '__name__', None)
+    if name is not None:
+        rv.__name__ = name
+        rv.__qualname__ = name
+    rv.__module__ = getattr(func, '__module__', None)
+    rv.__doc__ = getattr(func, '__doc__', None)
+    return rv
+
+
+def _nested(call, names):
+    # "s1(s0(call))"
+    for name in names:
+        call = '%s(%s)' % (name, call)
+    return call
+
+
+def _streamed(call, names, kinds):
+    # "s1(filter(s0, iter(call)))"
+    expr = '%siter(%s)' % (_prefix, call)
+    for name, kind in zip(names, kinds):
+        if kind == 'iter':
+            expr = '%s(%s)' % (name, expr)
+        elif kind == 'filter':
+            expr = '%sfilter(%s, %s)' % (_prefix, name, expr)
+        elif kind == 'map':
+            expr = '%smap(%s, %s)' % (_prefix, name, expr)
+        else:
+            raise ValueError('Unknown kind of stream stage: %r' % (kind,))
+    return expr
+
+
+def _awaited(call, iscoroutine, names, coroutines, executors):
+    # "(await s1(s0(await call)))", where ``executors`` maps the index of a
+    # stage to the name of the executor it is run in
+    expr = '(await %s)' % call if iscoroutine else call
+    for i, (name, coroutine) in enumerate(zip(names, coroutines)):
+        if coroutine:
+            expr = '(await %s(%s))' % (name, expr)
+        elif i in executors:
+            expr = '(await %sloop().run_in_executor(%s, %s, %s))' % (
+                _prefix, executors[i], name, expr)
+        else:
+            expr = '%s(%s)' % (name, expr)
+    return expr
+
+
+def compose(func, stages):
+    """ Compile ``stages`` applied in order to the result of ``func``
+
+    ``compose(f, [g, h])(*args, **kwargs)`` is equivalent to
+    ``h(g(f(*args, **kwargs)))``.  Returns None if a function with the same
+    signature as ``func`` can't be generated.
+    """
+    parameters = _parameters(func)
+    if parameters is None:
+        return None
+    params, args, namespace = parameters
+    namespace[_prefix + 'f'] = func
+    names = _stagenames(stages, namespace)
+    call = _nested('%sf(%s)' % (_prefix, ', '.join(args)), names)
+    source = 'def %schain(%s):\n    return %s\n' % (
+        _prefix, ', '.join(params), call)
+    return _define(source, namespace, func)
+
+
+def _header(func):
+    # like _parameters, but falls back to "*args, **kwargs"
+    parameters = _parameters(func)
+    if parameters is None:
+        params = ['*%sargs' % _prefix, '**%skwargs' % _prefix]
+        return params, params, {}
+    return parameters
+
+
+def compose_stream(func, stages, kinds):
+    """ Compile a lazy pipeline of ``stages`` over the iterable of ``func``
+
+    ``kinds`` gives how each stage is applied: 'map' calls the stage on each
+    item, 'filter' keeps the items for which the stage is true, and 'iter'
+    calls the stage once with the whole iterator, e.g.
+
+    ``compose_stream(f, [g, h, k], ['map', 'filter', 'iter'])(*args)`` is
+    ``k(filter(h, map(g, f(*args))))``.  Nothing is consumed until the
+    returned iterator is.
+    """
+    params, args, namespace = _header(func)
+    namespace[_prefix + 'f'] = func
+    namespace[_prefix + 'map'] = _map
+    namespace[_prefix + 'filter'] = _filter
+    namespace[_prefix + 'iter'] = iter
+    names = _stagenames(stages, namespace)
+    expr = _streamed('%sf(%s)' % (_prefix, ', '.join(args)), names, kinds)
+    source = 'def %schain(%s):\n    return %s\n' % (
+        _prefix, ', '.join(params), expr)
+    return _define(source, namespace, func)
+
+
+def compose_async(func, stages, blocking=None):
+    """ Compile an ``async def`` applying ``stages`` to the result of ``func``
+
+    Coroutine functions among ``func`` and ``stages`` are awaited, and other
+    stages are called inline without returning to the event loop.
+    ``blocking`` may map the index of a synchronous stage to the executor it
+    is run in instead (None for the event loop's default executor).  If the
+    signature of ``func`` can't be inspected, the generated function takes
+    ``*args`` and ``**kwargs``.
+    """
+    import asyncio
+    blocking = blocking or {}
+    params, args, namespace = _header(func)
+    namespace[_prefix + 'loop'] = getattr(asyncio, 'get_running_loop',
+                                          asyncio.get_event_loop)
+    namespace[_prefix + 'f'] = func
+    names = _stagenames(stages, namespace)
+    executors = {}
+    for i, executor in blocking.items():
+        executors[i] = '%se%d' % (_prefix, i)
+        namespace[executors[i]] = executor
+    expr = _awaited('%sf(%s)' % (_prefix, ', '.join(args)),
+                    iscoroutinefunction(func), names,
+                    [iscoroutinefunction(stage) for stage in stages],
+                    executors)
+    source = 'async def %schain(%s):\n    return %s\n' % (
+        _prefix, ', '.join(params), expr)
+    return _define(source, namespace, func)
+
+
+def compose_wrapper(func, transforms):
+    """ Compile one wrapper equivalent to a run of higher-order stages
+
+    ``transforms`` is a list of ``(args, result)`` pairs, one per stage in
+    the order the stages are applied, where either may be None.  ``args``
+    takes ``(args, kwargs)`` and returns new ``(args, kwargs)``, and
+    ``result`` takes the return value.  For example, with ``[(p0, r0), (p1,
+    r1)]`` the outermost stage's ``p1`` is applied to the arguments first,
+    then ``p0``, and the result is ``r1(r0(func(*args, **kwargs)))``.  The
+    generated function has the same signature as ``func`` if no ``args`` is
+    given and it can be inspected.
+    """
+    if any(pre is not None for pre, post in transforms):
+        params = args = ['*%sargs' % _prefix, '**%skwargs' % _prefix]
+        namespace = {}
+    else:
+        params, args, namespace = _header(func)
+    namespace[_prefix + 'f'] = func
+    lines = []
+    names = []
+    for i, (pre, post) in enumerate(transforms):
+        if post is not None:
+            names.append('%sr%d' % (_prefix, i))
+            namespace[names[-1]] = post
+        if pre is not None:
+            name = '%sp%d' % (_prefix, i)
+            namespace[name] = pre
+            lines.insert(0, '%sargs, %skwargs = %s(%sargs, %skwargs)'
+                         % (_prefix, _prefix, name, _prefix, _prefix))
+    lines.append('return %s' % _nested('%sf(%s)' % (_prefix, ', '.join(args)),
+                                       names))
+    source = 'def %schain(%s):\n    %s\n' % (
+        _prefix, ', '.join(params), '\n    '.join(lines))
+    rv = _define(source, namespace, func)
+    if rv is not None:
+        rv.__wrapped__ = func
+    return rv
+
+
+def compose_many(tries, others):
+    """ Compile a function that calls many chains, sharing common stages
+
+    ``tries`` is a list of ``(func, node)`` where each node of a trie is a
+    list of ``[{stage: node}, [keys]]``, so the value of a node is the stage
+    applied to the value of its parent, and the value of the root node is
+    ``func(*args, **kwargs)``.  ``others`` is a list of ``(key, function)``
+    to call as usual.  The generated function takes ``*args, **kwargs`` and
+    returns a dict of {key: value} of every key, and computes each node once.
+    """
+    namespace = {}
+    names = {}
+    lines = []
+    results = []
+
+    def ref(obj, kind):
+        name = names.get((kind, id(obj)))
+        if name is None:
+            name = '%s%s%d' % (_prefix, kind, len(names))
+            names[kind, id(obj)] = name
+            namespace[name] = obj
+        return name
+
+    call = '(*%sargs, **%skwargs)' % (_prefix, _prefix)
+    for func, node in tries:
+        var = '%sv%d' % (_prefix, len(lines))
+        lines.append('%s = %s%s' % (var, ref(func, 'f'), call))
+        stack = [(var, node)]
+        while stack:
+            var, (children, keys) = stack.pop()
+            results.extend((ref(key, 'k'), var) for key in keys)
+            for stage, child in children.items():
+                childvar = '%sv%d' % (_prefix, len(lines))
+                lines.append('%s = %s(%s)' % (childvar, ref(stage, 's'), var))
+                stack.append((childvar, child))
+    for key, func in others:
+        results.append((ref(key, 'k'), ref(func, 'f') + call))
+    items = ['%s: %s' % item for item in results]
+    lines.append('return {%s}' % ', '.join(items))
+    source = 'def %schain(*%sargs, **%skwargs):\n    %s\n' % (
+        _prefix, _prefix, _prefix, '\n    '.join(lines))
+    exec(compile(source, '<metafunc>', 'exec'), namespace)
+    return namespace[_prefix + 'chain']
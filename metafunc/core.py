@@ -1,25 +1,261 @@
+import fnmatch
+import gc
+import itertools
 import sys
+import threading
 import types
+import weakref
+from . import compiler
+from .batch import makebatch
+from .cache import LRUCache
+from .declare import (blocking, getprops, outermost, simplify, streamkinds,
+                      transforms, unwrap)
+from .instrument import build as instrumented, discard as discardstats
+
+try:
+    from importlib.machinery import ModuleSpec
+except ImportError:  # pragma: no cover
+    ModuleSpec = None
+
+# Chain functions shared by all MetaModules, keyed by
+# (first order function, tuple of metafuncs, composition, compiled, streaming)
+# in composition mode, by the same and the paths of ``chainrefs`` if a
+# metafunc is declared ``outer``, and by
+# (first order function, tuple of metafuncs, False, False) in HOF mode
+chaincache = LRUCache(maxsize=4096)
+# Functions found by ``resolve``, keyed by path
+resolvecache = LRUCache(maxsize=1024)
+# Paths of the functions given to outer stages, so they can be pickled by
+# reference (see ``_outerpaths``)
+chainrefs = weakref.WeakKeyDictionary()
+_missing = object()
+# Serializes the creation of roots and the installation of the loader
+_rootlock = threading.RLock()
+# Guards creating the dict of children of a trie node
+_trielock = threading.Lock()
+# Chain modules share a fixed number of locks rather than having one each
+_locks = tuple(threading.RLock() for i in range(64))
 
 
 class ModuleLoader(object):
-    """ Finds and loads modules when added to sys.meta_path (see PEP-302)"""
-    def __init__(self, source):
-        self._source = source
+    """ Finds and loads modules when added to sys.meta_path (see PEP-451)
 
-    def find_module(self, fullname, path=None):
+    A single instance is shared by every MetaModule in the process.  Root
+    and chain modules register themselves by full name, so finding a module
+    is a dict lookup regardless of how many MetaModules exist.  The
+    ``ModuleSpec`` of each chain is created once and cached.
+
+    The legacy ``find_module`` and ``load_module`` methods (see PEP-302) are
+    kept for Python versions without ``importlib.machinery.ModuleSpec``.
+    """
+    def __init__(self):
+        self._modules = {}
+        self._specs = {}
+
+    def register(self, module):
+        # More than one MetaModule may share a name (see
+        # `_hidden_metamodule_`).  Modules are referenced weakly, so they can
+        # be unloaded.
+        self._modules.setdefault(module.__name__, []).append(
+            weakref.ref(module))
+
+    def lookup(self, fullname):
+        """ Return a registered MetaModule by full name, or None"""
+        for ref in self._modules.get(fullname, ()):
+            module = ref()
+            if module is not None:
+                return module
+
+    def unregister(self, module):
+        """ Forget a module and its cached ModuleSpec"""
+        refs = [ref for ref in self._modules.get(module.__name__, ())
+                if ref() is not None and ref() is not module]
+        if refs:
+            self._modules[module.__name__] = refs
+        else:
+            self._modules.pop(module.__name__, None)
+            self._specs.pop(module.__name__, None)
+
+    def _getsource(self, fullname):
         base, dot, name = fullname.rpartition('.')
-        if base == self._source.__name__ and name in self._source._metafuncs:
+        for ref in self._modules.get(base, ()):
+            source = ref()
+            if source is not None and name in source._metafuncs:
+                return source, name
+        return None, name
+
+    def getspec(self, fullname):
+        """ Return the cached ModuleSpec of a MetaModule"""
+        spec = self._specs.get(fullname)
+        if spec is None and ModuleSpec is not None:
+            spec = self._specs.setdefault(
+                fullname, ModuleSpec(fullname, self, is_package=True))
+        return spec
+
+    def find_spec(self, fullname, path=None, target=None):
+        spec = self._specs.get(fullname)
+        if spec is not None:
+            return spec
+        source, name = self._getsource(fullname)
+        if source is not None:
+            return self.getspec(fullname)
+
+    def create_module(self, spec):
+        source, name = self._getsource(spec.name)
+        return source._apply_metafunc(name)
+
+    def exec_module(self, module):
+        # MetaModules are fully initialized when created
+        pass
+
+    def find_module(self, fullname, path=None):
+        source, name = self._getsource(fullname)
+        if source is not None:
             return self
 
     def load_module(self, fullname):
         # if the module is already loaded, we must return it
         if fullname in sys.modules:
             return sys.modules[fullname]
-        base, dot, name = fullname.rpartition('.')
-        item = MetaModule(name, self._source)
-        item.__loader__ = self
-        return item
+        source, name = self._getsource(fullname)
+        return source._apply_metafunc(name)
+
+
+_loader = ModuleLoader()
+
+
+def _install_loader():
+    if _loader not in sys.meta_path:
+        with _rootlock:
+            if _loader not in sys.meta_path:
+                sys.meta_path.append(_loader)
+
+
+class _Overlay(object):
+    """ A mapping that reads through a dict of overrides to a shared dict
+
+    Writes only go to the overrides.  This is the part of ``ChainMap`` that
+    templates need, which isn't available before Python 3.3.
+    """
+    def __init__(self, overrides, shared):
+        self.maps = [overrides, shared]
+
+    def __getitem__(self, key):
+        if key in self.maps[0]:
+            return self.maps[0][key]
+        return self.maps[1][key]
+
+    def __contains__(self, key):
+        return key in self.maps[0] or key in self.maps[1]
+
+    def __iter__(self):
+        for key in self.maps[0]:
+            yield key
+        for key in self.maps[1]:
+            if key not in self.maps[0]:
+                yield key
+
+    def __len__(self):
+        return len(set(self.maps[0]).union(self.maps[1]))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def update(self, other):
+        self.maps[0].update(other)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+
+class _Node(object):
+    """ A chain in the trie of a root MetaModule, keyed by metafunc name
+
+    Nodes hold only what is needed to build a chain, so many chains can be
+    explored (for example, by ``prefetch`` or ``metafunc.aot``) without
+    creating modules.  ``module`` is the MetaModule of the chain once the
+    import system or attribute access needs one.
+    """
+    __slots__ = ('name', 'func', 'parent', 'children', '_module', 'chain')
+
+    def __init__(self, name=None, func=None, parent=None):
+        self.name = name
+        self.func = func
+        self.parent = parent
+        self.children = None
+        self._module = None
+        # the simplified stages in the order they are applied
+        self.chain = None
+
+    @property
+    def module(self):
+        # modules are referenced weakly, so unloaded modules can be collected
+        return self._module and self._module()
+
+    @module.setter
+    def module(self, module):
+        self._module = weakref.ref(module)
+
+    def child(self, name, func):
+        """ Return the child node for metafunc ``name``, creating it if new"""
+        if self.children is None:
+            with _trielock:
+                if self.children is None:
+                    self.children = {}
+        node = self.children.get(name)
+        if node is None:
+            node = self.children.setdefault(name, _Node(name, func, self))
+        return node
+
+    @property
+    def stages(self):
+        """ The metafuncs along the path to this node"""
+        rv = []
+        node = self
+        while node.parent is not None:
+            rv.append(node.func)
+            node = node.parent
+        return tuple(reversed(rv))
+
+    def getchain(self, reverse=False):
+        chain = self.chain
+        if chain is None:
+            stages = self.stages
+            chain = self.chain = simplify(stages[::-1] if reverse else stages)
+        return chain
+
+    def walk(self):
+        """ Iterate over this node and every node below it"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.children:
+                stack.extend(list(node.children.values()))
+
+
+class _Shared(object):
+    """ An attribute of chain modules that is computed from their root or node
+
+    This is a non-data descriptor, so roots set the attribute themselves.
+    """
+    def __init__(self, get):
+        self.get = get
+
+    def __get__(self, module, cls=None):
+        if module is None:
+            return self
+        return self.get(module)
+
+
+def _option(name):
+    return _Shared(lambda module: module._root.__dict__[name])
 
 
 class MetaModule(types.ModuleType):
@@ -27,9 +263,40 @@ class MetaModule(types.ModuleType):
 
     The first order functions will be automatically populated, and
     higher-order functions will be generated upon demand.
+
+    A MetaModule is only published (to ``sys.modules``, its parent and the
+    loader) once it is fully initialized.  Child modules are created while
+    holding the parent's lock, so each chain is created once even when
+    imported from many threads.  Chain modules share a pool of locks by
+    hash of their name, so different branches rarely block each other.
+    Functions are built without a lock; if two threads race, the first
+    function stored on the module is used by both.  A function replaced by
+    ``addfuncs`` while it was being built is rebuilt rather than stored.
+
+    The state of each chain is kept in a compact trie (see ``_Node``), and
+    the options of the root are shared rather than copied to every module.
     """
+    _isfirst = False
+    _funcs = _option('_funcs')
+    _metafuncs = _option('_metafuncs')
+    _reverse = _option('_reverse')
+    _composition = _option('_composition')
+    _lazy = _option('_lazy')
+    _compiled = _option('_compiled')
+    _instrument = _option('_instrument')
+    _streaming = _option('_streaming')
+    _template = _option('_template')
+    _source = _Shared(lambda module: module._node.parent.module)
+    _lock = _Shared(
+        lambda module: _locks[hash(module.__name__) % len(_locks)])
+    _func = property(lambda self: self._node.func)
+    _stages = property(lambda self: self._node.stages)
+    _chain = property(lambda self: self._node.getchain(self._reverse))
+
     def __init__(self, name, source=None, metafuncs=None, funcs=None,
-                 reverse=False, composition=False):
+                 reverse=False, composition=False, lazy=False,
+                 compiled=False, instrument=False, streaming=False,
+                 template=None):
         # ensure proper adherence to module requirements
         try:
             fullname = source.__name__ + '.' + name
@@ -39,13 +306,13 @@ class MetaModule(types.ModuleType):
         self.__package__ = fullname
         self.__file__ = __file__
         self.__path__ = []
-        self._source = source
+        self.__loader__ = _loader
         if source is not None:
-            sys.modules[fullname] = self
-        sys.meta_path.append(ModuleLoader(self))
-
-        self._isfirst = not isinstance(source, MetaModule)
-        if self._isfirst:
+            self.__spec__ = _loader.getspec(fullname)
+        if not isinstance(source, MetaModule):
+            self._lock = threading.RLock()
+            self._isfirst = True
+            self._source = source
             if funcs is None:  # pragma: no cover
                 raise ValueError('"funcs" keyword required for root MetaModule')
             if metafuncs is None:  # pragma: no cover
@@ -53,37 +320,48 @@ class MetaModule(types.ModuleType):
             self._funcs = funcs
             self._metafuncs = metafuncs
             self._reverse = reverse
-            self._composition = composition
+            self._composition = composition or streaming
+            self._lazy = lazy
+            self._compiled = compiled
+            self._instrument = instrument
+            self._streaming = streaming
+            self._template = template
 
-            self._func = None
-            self.__all__ = []
-            for funcname in metafuncs:
-                self._apply_metafunc(funcname)
-            if source is None:
-                source_module = sys.modules[self.__package__]
-                setattr(source_module, '_hidden_metamodule_', self)
-            elif source:
-                setattr(source, name, self)
+            self._root = self
+            self._node = _Node()
+            self._node.module = self
+            # incremented whenever functions or metafuncs are added
+            self._version = 0
+            self._names = None
+            # functions of ``evaluate`` by paths and version
+            self._evaluators = LRUCache(maxsize=128)
+            # Hidden roots can't intercept attribute access on the source
+            # module, so their first level of MetaModules is always created.
+            if not lazy or source is None:
+                for funcname in list(metafuncs):
+                    self._apply_metafunc(funcname)
         else:
-            self._funcs = source._funcs
-            self._metafuncs = source._metafuncs
-            self._reverse = source._reverse
-            self._composition = source._composition
-
-            self._func = self._metafuncs[name]
-            self.__all__ = list(self._funcs)
-            for funcname in self._funcs:
-                self._apply(funcname)
+            self._root = source._root
+            self._node = source._node.child(name, self._metafuncs[name])
+            if not self._lazy:
+                for funcname in list(self._funcs):
+                    self._apply(funcname)
+        # publish the initialized module.  The loader must know it before
+        # other threads can find it in sys.modules and import its children.
+        _install_loader()
+        _loader.register(self)
+        if source is None:
+            source_module = sys.modules[self.__package__]
+            setattr(source_module, '_hidden_metamodule_', self)
+        else:
+            if not self._isfirst:
+                self._node.module = self
+            sys.modules[fullname] = self
+            if self._isfirst and source:
+                setattr(source, name, self)
 
     def _apply(self, funcname):
         orig_func = self._funcs[funcname]
-        funcs = []
-        module = self
-        while not module._isfirst:
-            funcs.append(module._func)
-            module = module._source
-
-        funcs.reverse()
         # TODO: support callbacks for better user-control
         # if self._funcfilter:
         #     res = self._funcfilter(self.__name__, funcs)
@@ -93,41 +371,54 @@ class MetaModule(types.ModuleType):
         #         return res
         #     elif isinstance(res, (list, tuple)):
         #         funcs = list(res)
-        if self._reverse:
-            funcs.reverse()
-
-        if self._composition:
-            # func1(func2(orig_func(*args, **kwargs)))
-            # reverse: func2(func1(orig_func(*args, **kwargs)))
-            def inner(*args, **kwargs):
-                rv = orig_func(*args, **kwargs)
-                for func in funcs:
-                    rv = func(rv)
-                return rv
-            rv = inner
+        refs = _outerpaths(self._root, self._node, funcname)
+        entry = resolvecache.get('%s.%s' % (self.__name__, funcname))
+        if entry is not None and entry[1]._version == entry[2]:
+            # ``resolve`` built it before this module existed, and it must
+            # stay the same function to pickle
+            rv = entry[0]
+        elif self._instrument:
+            # instrumented functions are specific to a module and not shared
+            inner, outer = outermost(self._chain)
+            rv = instrumented(self.__name__, funcname, orig_func, inner,
+                              self._composition, self._streaming)
+            rv = _applyouter(rv, outer, refs)
+        elif self._template is not None:
+            rv = self._template._getchain(self, funcname, refs)
         else:
-            # func1(func2(orig_func))(*args, **kwargs)
-            # reverse: func2(func1(orig_func))(*args, **kwargs)
-            rv = orig_func
-            for func in funcs:
-                rv = func(rv)
-        setattr(self, funcname, rv)
+            rv = _build(orig_func, self._chain, self._composition,
+                        self._compiled, self._streaming, refs)
+        rv = _setpath(rv, self.__name__, funcname,
+                      (orig_func,) + self._stages + self._chain)
+        # if another thread was first, use its function
+        rv = self.__dict__.setdefault(funcname, rv)
+        if self._funcs.get(funcname) is not orig_func:
+            # ``addfuncs`` replaced the function while it was being built,
+            # possibly after discarding the functions built from it
+            if self.__dict__.get(funcname) is rv:
+                del self.__dict__[funcname]
+            return self._apply(funcname)
         return rv
 
     def _apply_metafunc(self, funcname):
-        if self._source is None:
-            source_module = sys.modules[self.__package__]
-            fullname = '%s.%s' % (self.__package__, funcname)
-            if fullname in sys.modules:
-                raise ValueError('Cannot override module %s' % fullname)
-        # TODO: support callbacks for better user-control
-        # if self._metafuncfilter:
-        #     res = self._metafuncfilter(fullname, funcs)
-        #     ...
-        val = MetaModule(funcname, self)
-        setattr(self, funcname, val)
-        if self._source is None:
-            setattr(source_module, funcname, val)
+        fullname = '%s.%s' % (self.__package__, funcname)
+        with self._lock:
+            # the module may have been created while waiting for the lock
+            val = self.__dict__.get(funcname)
+            if isinstance(val, MetaModule):
+                return val
+            if self._source is None:
+                source_module = sys.modules[self.__package__]
+                if fullname in sys.modules:
+                    raise ValueError('Cannot override module %s' % fullname)
+            # TODO: support callbacks for better user-control
+            # if self._metafuncfilter:
+            #     res = self._metafuncfilter(fullname, funcs)
+            #     ...
+            val = MetaModule(funcname, self)
+            setattr(self, funcname, val)
+            if self._source is None:
+                setattr(source_module, funcname, val)
         return val
 
     def __getattr__(self, name):
@@ -135,12 +426,244 @@ class MetaModule(types.ModuleType):
         if self._isfirst:
             if name in self._funcs:
                 return self._funcs[name]
+        # Build functions on first access (always the case if "lazy")
+        elif name in self._funcs:
+            return self._apply(name)
         # Allow attribute chaining of metafuncs
-        elif name in self._metafuncs:
+        if name in self._metafuncs:
             val = self._apply_metafunc(name)
             if val is not None:
                 return val
-        raise AttributeError
+        raise AttributeError(name)
+
+    @property
+    def __all__(self):
+        if self._isfirst:
+            return []
+        return self._root._funcnames()
+
+    def _funcnames(self):
+        # the names of first order functions, updated when they change
+        names = self._names
+        if names is None or names[0] != self._version:
+            names = self._names = (self._version, list(self._funcs))
+        return names[1]
+
+    def __dir__(self):
+        names = set(self.__dict__)
+        names.update(self._funcs)
+        names.update(self._metafuncs)
+        return sorted(names)
+
+
+def _copyfunc(func):
+    # a function that shares the code, globals and closure of ``func``
+    rv = types.FunctionType(func.__code__, func.__globals__, func.__name__,
+                            func.__defaults__, func.__closure__)
+    rv.__dict__.update(func.__dict__)
+    rv.__doc__ = func.__doc__
+    rv.__kwdefaults__ = getattr(func, '__kwdefaults__', None)
+    return rv
+
+
+def _setpath(func, module_name, funcname, inputs=()):
+    """ Return a chain function that pickles as a reference to its module
+
+    Chain functions may be shared with other modules (through ``chaincache``
+    or a ``Template``), so the function returned is a copy of ``func`` that
+    shares its code and closure, and has the path of this module.  Only
+    functions created by building the chain are copied.  ``inputs`` are the
+    first order function and stages of the chain, which are returned as they
+    are if a chain returns one of them unchanged (for example, if a
+    higher-order function registers and returns its argument, or a chain
+    simplifies to nothing), as are functions that already have the path.
+    """
+    if not isinstance(func, types.FunctionType):
+        return func
+    if any(func is unwrap(obj) for obj in inputs):
+        return func
+    if func.__module__ == module_name and func.__qualname__ == funcname:
+        return func
+    func = _copyfunc(func)
+    func.__module__ = module_name
+    func.__qualname__ = funcname
+    return func
+
+
+def _compose(func, stages, compiled=False, streaming=False):
+    # func1(func2(orig_func(*args, **kwargs)))
+    # reverse: func2(func1(orig_func(*args, **kwargs)))
+    orig_func = unwrap(func)
+    funcs = tuple(map(unwrap, stages))
+    if streaming:
+        return compiler.compose_stream(orig_func, funcs, streamkinds(stages))
+    if any(map(compiler.iscoroutinefunction, (orig_func,) + funcs)):
+        return compiler.compose_async(orig_func, funcs, blocking(stages))
+    rv = None
+    if compiled:
+        rv = compiler.compose(orig_func, funcs)
+    if rv is None:
+        def inner(*args, **kwargs):
+            rv = orig_func(*args, **kwargs)
+            for func in funcs:
+                rv = func(rv)
+            return rv
+        rv = inner
+    rv.batch = makebatch(func, stages)
+    return rv
+
+
+def _outerpaths(root, node, funcname):
+    """ Return the path of the function each outer stage of a chain wraps
+
+    The function given to an outer stage is the chain without that stage
+    and the outer stages applied after it, so e.g. in "ns.inc.pmap.double"
+    it is "ns.inc.double".  Returns None if the chain has no outer stages,
+    or if simplifying the chain removed some of them.
+    """
+    outer = outermost(node.getchain(root._reverse))[1]
+    if not outer:
+        return None
+    names = []
+    while node.parent is not None:
+        names.append(node.name)
+        node = node.parent
+    names.reverse()
+    # indices of the names of outer stages, in the order they are applied
+    indices = [i for i, name in enumerate(names)
+               if getprops(root._metafuncs[name]).get('outer')]
+    if root._reverse:
+        indices.reverse()
+    if len(indices) != len(outer):
+        return None
+    rv = []
+    for k in range(len(indices)):
+        dropped = set(indices[k:])
+        rv.append('.'.join([root.__name__] +
+                           [name for i, name in enumerate(names)
+                            if i not in dropped] + [funcname]))
+    return rv
+
+
+def _setref(func, path):
+    try:
+        chainrefs[func] = path
+    except TypeError:  # pragma: no cover
+        # not weakly referenceable
+        pass
+
+
+def _buildouter(func, inner, outer, composition, compiled, streaming,
+                refs=None):
+    rv = _build(func, inner, composition, compiled, streaming)
+    return _applyouter(rv, outer, refs)
+
+
+def _applyouter(rv, outer, refs=None):
+    for i, stage in enumerate(outer):
+        if refs:
+            # the inner chain may be shared, but its path is not
+            if isinstance(rv, types.FunctionType):
+                rv = _copyfunc(rv)
+            _setref(rv, refs[i])
+        wrapped = unwrap(stage)(rv)
+        # ``functools.wraps`` copies ``batch``, which would skip the stage
+        if (wrapped is not rv and
+                getattr(wrapped, 'batch', None) is getattr(rv, 'batch', rv)):
+            del wrapped.batch
+        rv = wrapped
+    return rv
+
+
+def _build(func, stages, composition=False, compiled=False, streaming=False,
+           refs=None):
+    """ Apply ``stages`` in order to ``func``, reusing chains built before
+
+    Chains are shared through ``chaincache``.  In HOF mode the longest
+    cached prefix of ``stages`` is extended, so a chain one stage longer
+    than a cached chain needs only one higher-order function call.  Stages
+    declared as ``outer`` are applied to the chain of the other stages.
+    ``refs`` are the paths of the functions given to the outer stages
+    (see ``_outerpaths``), which are recorded in ``chainrefs``.
+    """
+    if not stages and not streaming:
+        return unwrap(func)
+    inner, outer = outermost(stages)
+    try:
+        hash(func)
+        hash(stages)
+    except TypeError:
+        # can't be cached
+        if outer:
+            return _buildouter(func, inner, outer, composition, compiled,
+                               streaming, refs)
+        if composition:
+            return _compose(func, stages, compiled, streaming)
+        rv = unwrap(func)
+        for end, rv in _applyhofs(rv, stages):
+            pass
+        return rv
+    if outer:
+        key = (func, stages, composition, compiled, streaming,
+               tuple(refs or ()))
+        rv = chaincache.get(key, _missing)
+        if rv is _missing:
+            rv = _buildouter(func, inner, outer, composition, compiled,
+                             streaming, refs)
+            chaincache[key] = rv
+        return rv
+    if composition:
+        key = (func, stages, True, compiled, streaming)
+        rv = chaincache.get(key, _missing)
+        if rv is _missing:
+            rv = _compose(func, stages, compiled, streaming)
+            chaincache[key] = rv
+        return rv
+    # func1(func2(orig_func))(*args, **kwargs)
+    # reverse: func2(func1(orig_func))(*args, **kwargs)
+    n = len(stages)
+    rv = _missing
+    while n and rv is _missing:
+        # don't extend a prefix that ends within a run of transforms
+        if n == len(stages) or not _inrun(stages, n):
+            rv = chaincache.get((func, stages[:n], False, False), _missing)
+        if rv is _missing:
+            n -= 1
+    if rv is _missing:
+        rv = unwrap(func)
+    for end, rv in _applyhofs(rv, stages[n:]):
+        chaincache[(func, stages[:n + end], False, False)] = rv
+    return rv
+
+
+def _inrun(stages, n):
+    # whether stages n - 1 and n both have declared transforms
+    return (transforms(stages[n - 1]) is not None and
+            transforms(stages[n]) is not None)
+
+
+def _applyhofs(func, stages):
+    """ Apply HOF ``stages`` in order to ``func``
+
+    Runs of two or more stages with declared ``result`` or ``args``
+    transforms are compiled into a single wrapper.  Yields ``(end, func)``
+    after each stage or run, where ``end`` is the number of stages applied.
+    """
+    i = 0
+    while i < len(stages):
+        j = i
+        while j < len(stages) and transforms(stages[j]) is not None:
+            j += 1
+        rv = None
+        if j - i > 1 and not compiler.iscoroutinefunction(func):
+            rv = compiler.compose_wrapper(
+                func, [transforms(stage) for stage in stages[i:j]])
+        if rv is None:
+            j = i + 1
+            rv = unwrap(stages[i])(func)
+        func = rv
+        i = j
+        yield i, func
 
 
 def _process_funcs(funcs):
@@ -156,7 +679,8 @@ def _process_funcs(funcs):
     return funcs
 
 
-def metafunc(module_name, metafuncs, funcs, reverse=False, composition=False):
+def metafunc(module_name, metafuncs, funcs, reverse=False, composition=False,
+             lazy=False, compiled=False, instrument=False, streaming=False):
     """ Create a module of higher-order functions that can be chained on import
 
     For example:
@@ -177,6 +701,10 @@ def metafunc(module_name, metafuncs, funcs, reverse=False, composition=False):
     Keyword Arguments:
     reverse (default False) -- determines the order to apply the hofs
     composition (default False) -- determines how hofs are applied (see below)
+    lazy (default False) -- build functions and modules upon first access
+    compiled (default False) -- generate straight-line composition functions
+    instrument (default False) -- record calls and times of chain functions
+    streaming (default False) -- chain stages lazily over iterables (see below)
 
     # Example import with hofs "higher1" and "higher2", and fof "first"
     >>> from hof_module.higher1.higher2 import first
@@ -188,7 +716,71 @@ def metafunc(module_name, metafuncs, funcs, reverse=False, composition=False):
 
     If ``reverse`` is True, then the order of "higher1" and "higher2" from
     above are reversed.
+
+    If ``lazy`` is True, then "higher2(higher1(first))" is only created when
+    "first" is imported or accessed as an attribute, and is then cached on
+    the module.  This keeps the cost of importing large namespaces
+    proportional to the functions that are actually used.
+
+    Higher-order functions annotated with ``metafunc.declare`` (for example,
+    as idempotent or as the inverse of another) are simplified away before
+    the functions of a chain are built.  In HOF mode, runs of hofs declared
+    with an equivalent ``result`` or ``args`` transform are compiled into a
+    single wrapper, so deep chains don't nest one closure per hof.
+
+    ``metafunc.hofs`` provides ready-made metafuncs, such as ``cached``,
+    which caches the results of the whole chain (in either mode).
+
+    If ``compiled`` and ``composition`` are True, then a function such as
+    "def first(x): return higher2(higher1(first(x)))" is generated for each
+    chain with the same signature as "first".  If the signature of "first"
+    can't be inspected, the generic "*args, **kwargs" version is used.
+
+    In composition mode, chain functions also have a ``batch`` method that
+    runs the chain stage by stage over a sequence or NumPy array of inputs
+    (see ``metafunc.batch``).  Chains with ``outer`` stages don't, since
+    a batch would bypass them.
+
+    If the first order function or any stage of a composition chain is a
+    coroutine function, then the chain is an ``async def`` function that
+    awaits those and calls the others inline.  Synchronous stages declared
+    with ``declare(func, blocking=True)`` are run in an executor instead.
+    In HOF mode, the higher-order functions must support coroutine
+    functions themselves.
+
+    If ``instrument`` is True, then calls and the time spent in each stage
+    are recorded for every chain function.  See ``metafunc.instrument`` for
+    how to take, reset and export snapshots of the results.
+
+    If ``streaming`` is True (which implies ``composition``), then "first"
+    returns an iterable and each stage is applied lazily to its items:
+        "map(higher2, map(higher1, iter(first(*args, **kwargs))))"
+    Nothing is computed until the returned iterator is consumed, and only one
+    item at a time is held by the pipeline.  Stages declared with
+    ``declare(func, stream='filter')`` keep the items for which they return
+    true, and ``stream='iter'`` stages are called once with the whole
+    iterator (for example, to chunk or deduplicate items).
+
+    To create many roots that share the same functions and metafuncs, use
+    a ``Template``, which shares the tables and built chain functions.
+
+    Chain functions pickle by reference, such as "hof_module.higher1.first",
+    so they can be sent to a ``multiprocessing.Pool`` or
+    ``ProcessPoolExecutor``.  The chain is rebuilt upon unpickling, so the
+    root must also be created by ``metafunc`` in the worker process (for
+    example, when the module that calls ``metafunc`` is imported).
     """
+    funcs = _process_funcs(funcs)
+    metafuncs = _process_funcs(metafuncs)
+    if set(funcs).intersection(metafuncs):
+        raise ValueError('Cannot use same name for funcs and metafuncs')
+    return _createroot(module_name, metafuncs, funcs, reverse=reverse,
+                       composition=composition, lazy=lazy, compiled=compiled,
+                       instrument=instrument, streaming=streaming)
+
+
+def _createroot(module_name, metafuncs, funcs, **options):
+    """ Create and return a root MetaModule from normalized tables"""
     # if input is a module object, get its name
     module_name = getattr(module_name, '__name__', module_name)
     # partition package name into module path name and module name
@@ -202,63 +794,512 @@ def metafunc(module_name, metafuncs, funcs, reverse=False, composition=False):
                            MetaModule)):
             raise ValueError('Calling "metafunc" on MetaModules not supported')
 
-    funcs = _process_funcs(funcs)
-    metafuncs = _process_funcs(metafuncs)
-    if set(funcs).intersection(metafuncs):
-        raise ValueError('Cannot use same name for funcs and metafuncs')
-
-    if module_name in sys.modules:
-        MetaModule(module_name, None, metafuncs, funcs, reverse=reverse,
-                   composition=composition)
-        meta_module = sys.modules[module_name]
-    else:
-        meta_module = MetaModule(meta_name, source_module, metafuncs,
-                                 funcs, reverse=reverse,
-                                 composition=composition)
+    with _rootlock:
+        if module_name in sys.modules:
+            MetaModule(module_name, None, metafuncs, funcs, **options)
+            meta_module = sys.modules[module_name]
+        else:
+            meta_module = MetaModule(meta_name, source_module, metafuncs,
+                                     funcs, **options)
     return meta_module
 
 
+class Template(object):
+    """ Function tables shared by many roots, which copy them only on write
+
+    For example, to create a root per tenant that share a large namespace:
+
+    >>> template = Template([inc, double], [one, two, three])
+    >>> template.instantiate('tenant1')  # doctest: +SKIP
+    >>> template.instantiate('tenant2', funcs=[('one', other_one)])
+    ...                                  # doctest: +SKIP
+
+    The arguments are those of ``metafunc`` that are shared by the roots.
+    The functions and metafuncs are normalized once, and each root reads
+    them through an overlay whose first layer holds its own overrides
+    (including those later added by ``addfuncs`` and ``addmetafuncs``), so
+    creating a lazy root costs time proportional to its overrides.
+
+    Chain functions built by any root are also kept by the template and
+    reused by the other roots, unless the chain uses an overridden function
+    or metafunc.  ``prebuild`` builds them ahead of time.  As with
+    ``chaincache``, each module has its own copy of a shared chain function,
+    so it pickles as a reference to that module.
+    """
+    def __init__(self, metafuncs, funcs, reverse=False, composition=False,
+                 compiled=False, streaming=False):
+        self._funcs = _process_funcs(funcs)
+        self._metafuncs = _process_funcs(metafuncs)
+        if set(self._funcs).intersection(self._metafuncs):
+            raise ValueError('Cannot use same name for funcs and metafuncs')
+        self._reverse = reverse
+        self._composition = composition or streaming
+        self._compiled = compiled
+        self._streaming = streaming
+        # a trie of chains, as in a root, for ``prebuild``
+        self._node = _Node()
+        # chain functions by (funcname, simplified stages)
+        self._chains = LRUCache(maxsize=4096)
+
+    def instantiate(self, module_name, metafuncs=None, funcs=None, lazy=True,
+                    instrument=False):
+        """ Create a root MetaModule from the template
+
+        Arguments:
+        module_name -- the name of the created module, as for ``metafunc``
+
+        Keyword Arguments:
+        metafuncs -- metafuncs to add or replace for this root only
+        funcs -- first order functions to add or replace for this root only
+        lazy (default True) -- build functions and modules upon first access
+        instrument (default False) -- record calls and times of chain
+                                      functions (which aren't shared)
+
+        Returns the root MetaModule.
+        """
+        metafuncs = _process_funcs(metafuncs)
+        funcs = _process_funcs(funcs)
+        for name in funcs:
+            if name in metafuncs or name in self._metafuncs:
+                raise ValueError('Cannot use same name for funcs and '
+                                 'metafuncs: %r' % (name,))
+        for name in metafuncs:
+            if name in self._funcs:
+                raise ValueError('Cannot use same name for funcs and '
+                                 'metafuncs: %r' % (name,))
+        return _createroot(module_name, _Overlay(metafuncs, self._metafuncs),
+                           _Overlay(funcs, self._funcs), reverse=self._reverse,
+                           composition=self._composition, lazy=lazy,
+                           compiled=self._compiled, instrument=instrument,
+                           streaming=self._streaming, template=self)
+
+    def _shares(self, module, funcname):
+        # whether the chain uses only the template's function and metafuncs
+        if module._funcs.get(funcname) is not self._funcs.get(funcname):
+            return False
+        node = module._node
+        while node.parent is not None:
+            if self._metafuncs.get(node.name) is not node.func:
+                return False
+            node = node.parent
+        return True
+
+    def _getchain(self, module, funcname, refs=None):
+        """ Return the chain function of ``funcname`` for a MetaModule"""
+        func = module._funcs[funcname]
+        chain = module._chain
+        if not self._shares(module, funcname):
+            return _build(func, chain, self._composition, self._compiled,
+                          self._streaming, refs)
+        return self._shared(funcname, chain, refs)
+
+    def _shared(self, funcname, chain, refs=None):
+        key = (funcname, chain, tuple(refs or ()))
+        try:
+            rv = self._chains.get(key)
+        except TypeError:
+            # can't be shared
+            return _build(self._funcs[funcname], chain, self._composition,
+                          self._compiled, self._streaming, refs)
+        if rv is None:
+            rv = _build(self._funcs[funcname], chain, self._composition,
+                        self._compiled, self._streaming, refs)
+            self._chains[key] = rv
+        return rv
+
+    def prebuild(self, paths=None, depth=None):
+        """ Build chain functions ahead of time for every root to share
+
+        ``paths`` and ``depth`` select chains as for ``prefetch``.  Chains
+        with ``outer`` stages are skipped, since the functions given to those
+        stages pickle as a path of their root (see ``_outerpaths``).  Returns
+        the number of chain functions built or already kept.
+        """
+        count = 0
+        for path in _chainpaths(self, paths, depth):
+            node = self._node
+            for name in path:
+                node = node.child(name, self._metafuncs[name])
+            chain = node.getchain(self._reverse)
+            if outermost(chain)[1]:
+                continue
+            for funcname in self._funcs:
+                self._shared(funcname, chain)
+                count += 1
+        return count
+
+
 def getrootmodule(module_name):
     # if input is a module object, get its name
     module_name = getattr(module_name, '__name__', module_name)
     if module_name not in sys.modules:
         raise ValueError('Bad module name')
     module = sys.modules[module_name]
+    module = getattr(module, '_hidden_metamodule_', module)
     if not isinstance(module, MetaModule):
         raise ValueError('Bad module type')
-    while not module._isfirst:
-        module = module._source
-    return module
+    return module._root
+
 
+def addfuncs(module_name, funcs, replace=False):
+    """ Add first order functions to a tree of MetaModules
 
-def addfuncs(module_name, funcs):
+    Existing modules build the new functions upon first access.  If
+    ``replace`` is True, functions that are already defined may be changed.
+    Functions built from them are discarded and rebuilt upon next access.
+    """
     module = getrootmodule(module_name)
 
     funcs = _process_funcs(funcs)
     funcset = set(funcs)
-    if funcset.intersection(module._funcs):
-        raise ValueError('First order function already defined')
-    if funcset.intersection(module._metafuncs):
-        raise ValueError('Function name already used by higher-order function')
-    module._funcs.update(funcs)
-    nextmodules = [getattr(module, item) for item in module._metafuncs]
-    while nextmodules:
-        module = nextmodules.pop()
-        for funcname in funcs:
-            module._apply(funcname)
-        nextmodules.extend(getattr(module, item) for item in module._metafuncs
-                           if module.__package__ + '.' + item in sys.modules)
+    with module._lock:
+        if not replace and funcset.intersection(module._funcs):
+            raise ValueError('First order function already defined')
+        if funcset.intersection(module._metafuncs):
+            raise ValueError('Function name already used by higher-order '
+                             'function')
+        changed = [name for name in funcs
+                   if module._funcs.get(name, funcs[name]) is not funcs[name]]
+        module._funcs.update(funcs)
+        module._version += 1
+        if changed:
+            for node in module._node.walk():
+                if node.module is not None and node.module is not module:
+                    for name in changed:
+                        node.module.__dict__.pop(name, None)
+
+
+def _unpublish(module):
+    # remove a module from sys.modules, its parent and the loader
+    name = module.__name__.rpartition('.')[2]
+    if sys.modules.get(module.__name__) is module:
+        del sys.modules[module.__name__]
+    if module._isfirst:
+        source = module._source
+        if source is None:
+            source = sys.modules.get(module.__name__)
+            # its first level was already removed from the source module
+            if getattr(source, '_hidden_metamodule_', None) is module:
+                del source._hidden_metamodule_
+        elif source and getattr(source, name, None) is module:
+            delattr(source, name)
+    else:
+        parent = module._node.parent.module
+        if parent is not None and parent.__dict__.get(name) is module:
+            del parent.__dict__[name]
+        if parent is not None and parent._isfirst and parent._source is None:
+            # the first level of a hidden root is also on the source module
+            source = sys.modules.get(parent.__name__)
+            if getattr(source, name, None) is module:
+                delattr(source, name)
+    _loader.unregister(module)
+
+
+def _liveroots():
+    rv = []
+    for refs in list(_loader._modules.values()):
+        for ref in refs:
+            module = ref()
+            if module is not None and module._isfirst:
+                rv.append(module)
+    return rv
+
+
+def unload(module_name):
+    """ Remove a tree of MetaModules, or a chain module and the chains below it
+
+    Arguments:
+    module_name -- the name (or module object) of a root created by
+                   ``metafunc`` or of any chain module
+
+    The modules are removed from ``sys.modules``, their parents, the loader
+    and ``metafunc.instrument``, so they can be garbage collected.  When a
+    root is unloaded, the chain functions of ``chaincache`` built from its
+    first order functions are also evicted, unless another root uses them.
+    Unloading a chain module of a root that still exists only discards it;
+    it is created again if it is imported or accessed (or right away, for
+    the first level of a root created on an existing module).
+    """
+    name = getattr(module_name, '__name__', module_name)
+    module = sys.modules.get(name)
+    module = getattr(module, '_hidden_metamodule_', module)
+    if not isinstance(module, MetaModule):
+        raise ValueError('Bad module name')
+    with _rootlock:
+        with module._lock:
+            node = module._node
+            modules = [n.module for n in node.walk() if n.module is not None]
+            # children first, which also breaks the cycles between parents
+            # and children
+            for item in reversed(modules):
+                _unpublish(item)
+            if node.parent is not None:
+                node.parent.children.pop(node.name, None)
+                parent = node.parent.module
+                if (parent is not None and parent._isfirst and
+                        parent._source is None):
+                    # the source module of a hidden root can't create its
+                    # first level upon access, so it is created again now
+                    parent._apply_metafunc(node.name)
+            else:
+                node.children = None
+            discardstats(item.__name__ for item in modules)
+            if module._isfirst:
+                funcs = set(map(id, map(unwrap, module._funcs.values())))
+                for root in _liveroots():
+                    funcs.difference_update(
+                        map(id, map(unwrap, root._funcs.values())))
+                chaincache.discard(lambda key: id(unwrap(key[0])) in funcs)
+        resolvecache.clear()
+        if not _loader._modules and _loader in sys.meta_path:
+            sys.meta_path.remove(_loader)
+
+
+def resolve(path):
+    """ Return the function of a path such as "zmm.hofs.doubled.tripled.one"
+
+    This is like importing the function, but the MetaModules of the chain
+    aren't created unless they already exist (or the root is instrumented),
+    and the function is cached by path in ``resolvecache`` until functions
+    of the root are added or replaced, so it is cheap to call repeatedly.
+    Raises ValueError if the path doesn't name a chain function.
+    """
+    entry = resolvecache.get(path)
+    if entry is not None and entry[1]._version == entry[2]:
+        return entry[0]
+    module_name, dot, funcname = path.rpartition('.')
+    # find the closest registered module, then walk the trie from there
+    base = module_name
+    names = []
+    start = None
+    while base:
+        start = _loader.lookup(base)
+        if start is not None:
+            break
+        base, dot, name = base.rpartition('.')
+        names.append(name)
+    if start is None:
+        raise ValueError('No MetaModule for %r' % (path,))
+    names.reverse()
+    root = start._root
+    version = root._version
+    if funcname not in root._funcs:
+        raise ValueError('%r is not a first order function of %r'
+                         % (funcname, root.__name__))
+    node = start._node
+    for name in names:
+        if name not in root._metafuncs:
+            raise ValueError('%r is not a metafunc of %r'
+                             % (name, root.__name__))
+        node = node.child(name, root._metafuncs[name])
+    module = node.module
+    if module is None and root._instrument:
+        # instrumented functions belong to their module
+        module = start
+        for name in names:
+            module = getattr(module, name)
+    if module is not None:
+        func = getattr(module, funcname)
+    else:
+        orig_func = root._funcs[funcname]
+        chain = node.getchain(root._reverse)
+        func = _build(orig_func, chain, root._composition, root._compiled,
+                      root._streaming, _outerpaths(root, node, funcname))
+        func = _setpath(func, module_name, funcname,
+                        (orig_func,) + node.stages + chain)
+    resolvecache[path] = (func, root, version)
+    return func
+
+
+def _chainpaths(root, paths=None, depth=None):
+    """ Return the chains in ``paths`` and up to ``depth`` as tuples of names
+
+    Each path is a dotted string such as "inc.double" or a sequence of
+    names, and each name may be a glob pattern such as "inc.*".  Every
+    prefix of a chain is included, and shorter chains come first.
+    """
+    rv = set()
+    names = sorted(root._metafuncs)
+    if depth:
+        for i in range(1, depth + 1):
+            rv.update(itertools.product(names, repeat=i))
+    for path in paths or ():
+        if isinstance(path, str):
+            path = path.split('.')
+        matches = []
+        for pattern in path:
+            matches.append(fnmatch.filter(names, pattern))
+            if not matches[-1]:
+                raise ValueError('No metafunc matches %r in %r'
+                                 % (pattern, '.'.join(path)))
+        rv.update(itertools.product(*matches))
+    for path in list(rv):
+        for i in range(1, len(path)):
+            rv.add(path[:i])
+    return sorted(rv, key=lambda path: (len(path), path))
+
+
+def _materialize(root, paths):
+    rv = []
+    for path in paths:
+        module = root
+        for name in path:
+            module = getattr(module, name)
+        for funcname in list(module._funcs):
+            getattr(module, funcname)
+        rv.append(module)
+    return rv
+
+
+def prefetch(module_name, paths=None, depth=None, executor=None,
+             freeze=False):
+    """ Create chain modules and their functions ahead of first use
+
+    Arguments:
+    module_name -- the name (or module object) of a tree of MetaModules
+
+    Keyword Arguments:
+    paths -- chains such as "inc.double", which may be glob patterns
+             such as "inc.*" (see ``fnmatch``)
+    depth -- also create every chain of up to this many metafuncs
+    executor -- create the chains in this ``concurrent.futures`` executor
+    freeze (default False) -- move everything to the permanent generation
+                              with ``gc.freeze`` (see below)
+
+    Returns a list of the chain modules, or if ``executor`` is given, a list
+    of futures of lists of chain modules (one per first level branch).
+
+    ``freeze`` is meant for pre-fork servers: call ``prefetch`` in the parent
+    process before forking, so the tree is shared copy-on-write by the
+    workers instead of being rebuilt (and touched by the garbage collector)
+    in each of them.  It can't be used with an executor.
+    """
+    root = getrootmodule(module_name)
+    paths = _chainpaths(root, paths, depth)
+    if executor is None:
+        rv = _materialize(root, paths)
+        if freeze and hasattr(gc, 'freeze'):
+            gc.collect()
+            gc.freeze()
+        return rv
+    if freeze:
+        raise ValueError('"freeze" requires prefetching without an executor')
+    # different branches don't contend for the same locks
+    return [executor.submit(_materialize, root, list(group))
+            for key, group in itertools.groupby(
+                sorted(paths), key=lambda path: path[0])]
+
+
+def _parsepath(root, path):
+    """ Split a path such as "inc.double.one" into metafuncs and function"""
+    if isinstance(path, str):
+        path = path.split('.')
+    names = tuple(path[:-1])
+    funcname = path[-1] if path else None
+    if funcname not in root._funcs:
+        raise ValueError('Bad path %r: %r is not a first order function'
+                         % (path, funcname))
+    for name in names:
+        if name not in root._metafuncs:
+            raise ValueError('Bad path %r: %r is not a metafunc'
+                             % (path, name))
+    return names, funcname
+
+
+def _shareable(root, func, chain):
+    # only plain synchronous composition chains can share intermediate values
+    return (root._composition and not root._streaming and
+            not root._instrument and not outermost(chain)[1] and
+            not any(map(compiler.iscoroutinefunction,
+                        [unwrap(func)] + [unwrap(stage) for stage in chain])))
+
+
+def evaluator(module_name, paths):
+    """ Return a function that calls many chain functions, sharing common work
+
+    Arguments:
+    module_name -- the name (or module object) of a tree of MetaModules
+    paths -- chain functions such as "inc.double.one" or
+             ["inc", "double", "one"], relative to the root
+
+    The returned function takes the arguments for every chain function and
+    returns a dict of {path: result}, where paths that are sequences become
+    tuples.  Chains are grouped by first order function into a trie of
+    their (simplified) stages, and a straight-line function is generated
+    that computes each node of the trie once.  Chains that can't share
+    values (in HOF or streaming mode, with coroutine functions, ``outer``
+    stages or instrumentation) are called as usual.
+    """
+    root = getrootmodule(module_name)
+    tries = {}
+    others = []
+    for path in paths:
+        names, funcname = _parsepath(root, path)
+        if not isinstance(path, str):
+            path = tuple(path)
+        node = root._node
+        for name in names:
+            node = node.child(name, root._metafuncs[name])
+        chain = node.getchain(root._reverse)
+        func = root._funcs[funcname]
+        if not _shareable(root, func, chain):
+            module = root
+            for name in names:
+                module = getattr(module, name)
+            others.append((path, getattr(module, funcname)))
+            continue
+        # each node of the trie is [{stage: child node}, [paths]]
+        trienode = tries.setdefault(funcname, [{}, []])
+        for stage in chain:
+            trienode = trienode[0].setdefault(unwrap(stage), [{}, []])
+        trienode[1].append(path)
+    return compiler.compose_many(
+        [(unwrap(root._funcs[funcname]), trienode)
+         for funcname, trienode in tries.items()], others)
+
+
+def evaluate(module_name, paths, *args, **kwargs):
+    """ Call many chain functions with the same arguments, sharing common work
+
+    For example,
+
+    >>> evaluate('zmm.comp', ['inc.double.one', 'inc.triple.one',
+    ...                       'inc.double.inc.one'])  # doctest: +SKIP
+    {'inc.double.one': 4, 'inc.triple.one': 6, 'inc.double.inc.one': 5}
+
+    calls "one" once and "inc" once, and "double" once for the two chains
+    that start with "inc.double".  See ``evaluator``, whose functions are
+    cached for each root and set of paths.
+    """
+    root = getrootmodule(module_name)
+    paths = tuple(path if isinstance(path, str) else tuple(path)
+                  for path in paths)
+    key = (paths, root._version)
+    func = root._evaluators.get(key)
+    if func is None:
+        func = evaluator(root, paths)
+        root._evaluators[key] = func
+    return func(*args, **kwargs)
 
 
 def addmetafuncs(module_name, metafuncs):
+    """ Add higher-order functions to a tree of MetaModules
+
+    Modules for the new higher-order functions are created upon first access.
+    """
     module = getrootmodule(module_name)
 
     metafuncs = _process_funcs(metafuncs)
     metafuncset = set(metafuncs)
-    if metafuncset.intersection(module._metafuncs):
-        raise ValueError('Higher-order function already defined')
-    if metafuncset.intersection(module._funcs):
-        raise ValueError('Function name already used by first order function')
-    module._metafuncs.update(metafuncs)
-    for funcname in metafuncs:
-        module._apply_metafunc(funcname)
+    with module._lock:
+        if metafuncset.intersection(module._metafuncs):
+            raise ValueError('Higher-order function already defined')
+        if metafuncset.intersection(module._funcs):
+            raise ValueError('Function name already used by first order '
+                             'function')
+        module._metafuncs.update(metafuncs)
+        module._version += 1
+        if module._source is None:
+            # attributes of the source module of a hidden root must exist
+            for funcname in metafuncs:
+                module._apply_metafunc(funcname)
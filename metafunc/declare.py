@@ -0,0 +1,247 @@
+""" Declare algebraic properties of metafuncs to simplify chains
+
+Properties are attached to a metafunc with ``declare`` before passing it
+to ``metafunc`` or ``addmetafuncs``:
+
+>>> inc = declare(inc, inverse=dec, commutative='add',
+...               fuse=lambda k: lambda x: x + k)
+
+Chains are rewritten by ``simplify`` before they are built, so a chain
+such as "inc.inc.dec.inc" costs the same as a single stage.  Properties
+apply to stages in both HOF and composition mode:
+
+- identity -- the stage does nothing and is dropped
+- idempotent -- repeating the stage has no further effect
+- inverse -- a metafunc that cancels this one when adjacent
+- commutative -- the name of a group of stages that commute with each
+  other, such as 'add' for stages that add a constant.  Runs of stages of
+  the same group are put into a canonical order.
+- fuse -- a callable that takes a count ``k`` and returns a single stage
+  equivalent to applying this stage ``k`` times in a row
+
+Other properties describe how a stage may be called:
+
+- vectorize -- the stage accepts a whole NumPy array (see ``metafunc.batch``)
+- stream -- how the stage is applied in streaming mode: 'map' (the
+  default) calls it on every item, 'filter' keeps the items for which it
+  is true, and 'iter' calls it once with the iterator of all items
+- outer -- the stage decorates the whole chain function, such as a cache
+  of its results.  It is applied last in both HOF and composition mode,
+  wherever it appears in the chain.
+- blocking -- in a chain of coroutine functions, the synchronous stage is
+  run in an executor so it doesn't block the event loop.  This may be True
+  for the loop's default executor, or an executor to use.
+
+Higher-order metafuncs that only transform the arguments or the result of
+the function they wrap may declare equivalent plain functions:
+
+- result -- a function of the return value, so ``stage(f)(*args)`` is
+  ``result(f(*args))``
+- args -- a function of ``(args, kwargs)`` returning new ``(args,
+  kwargs)``, so ``stage(f)(*args, **kwargs)`` calls ``f`` with them
+
+In HOF mode, runs of such stages are compiled into a single wrapper, so a
+deep chain calls one function rather than one closure per stage.  The
+higher-order function itself is then not called, so the declared
+functions must be equivalent to it.
+
+>>> doubled = declare(doubled, result=lambda x: 2 * x)
+"""
+
+_properties = frozenset(['identity', 'idempotent', 'inverse', 'commutative',
+                         'fuse', 'vectorize', 'blocking', 'stream', 'outer',
+                         'result', 'args'])
+_streamkinds = frozenset(['map', 'filter', 'iter'])
+_noproperties = {}
+
+
+class Declared(object):
+    """ A metafunc with declared properties
+
+    Calling it calls the original function, which is used directly when
+    chains are built.
+    """
+    def __init__(self, func, properties):
+        if isinstance(func, Declared):
+            properties = dict(func.properties, **properties)
+            func = func.func
+        unknown = set(properties).difference(_properties)
+        if unknown:
+            raise TypeError('Unknown properties: %s'
+                            % ', '.join(sorted(unknown)))
+        if isinstance(properties.get('commutative'), bool):
+            raise ValueError('"commutative" property must name the group of '
+                             'stages the stage commutes with, not %r'
+                             % (properties['commutative'],))
+        if properties.get('stream', 'map') not in _streamkinds:
+            raise ValueError('Bad "stream" property: %r'
+                             % (properties['stream'],))
+        for name in ('result', 'args'):
+            transform = properties.get(name)
+            if transform is not None and not callable(transform):
+                raise TypeError('"%s" property must be callable, not %r'
+                                % (name, transform))
+        if properties.get('inverse') is not None:
+            properties['inverse'] = unwrap(properties['inverse'])
+        self.func = func
+        self.properties = properties
+        self.__name__ = getattr(func, '__name__', None)
+        self.__doc__ = getattr(func, '__doc__', None)
+        self._fused = {}
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        props = ', '.join('%s=%r' % item
+                          for item in sorted(self.properties.items()))
+        return 'declare(%r, %s)' % (self.func, props)
+
+    def fused(self, count):
+        """ Return a stage equivalent to ``count`` repeats of this stage"""
+        try:
+            return self._fused[count]
+        except KeyError:
+            return self._fused.setdefault(count,
+                                          self.properties['fuse'](count))
+
+
+def declare(func=None, **properties):
+    """ Attach properties to a metafunc (see module docstring)
+
+    May also be used as a decorator:
+
+    >>> @declare(idempotent=True)
+    ... def absolute(x):
+    ...     return abs(x)
+    """
+    if func is None:
+        return lambda func: Declared(func, properties)
+    return Declared(func, properties)
+
+
+def getprops(func):
+    """ Return the dict of properties declared for ``func``"""
+    if isinstance(func, Declared):
+        return func.properties
+    return _noproperties
+
+
+def unwrap(func):
+    """ Return the original function of a declared metafunc"""
+    if isinstance(func, Declared):
+        return func.func
+    return func
+
+
+def blocking(stages):
+    """ Return a dict of {index: executor} of stages declared as blocking"""
+    rv = {}
+    for i, stage in enumerate(stages):
+        executor = getprops(stage).get('blocking')
+        if executor is not None and executor is not False:
+            rv[i] = None if executor is True else executor
+    return rv
+
+
+def streamkinds(stages):
+    """ Return how each of ``stages`` is applied in streaming mode"""
+    return [getprops(stage).get('stream', 'map') for stage in stages]
+
+
+def outermost(stages):
+    """ Split ``stages`` into a tuple of inner stages and of outer stages"""
+    inner = []
+    outer = []
+    for stage in stages:
+        if getprops(stage).get('outer'):
+            outer.append(stage)
+        else:
+            inner.append(stage)
+    return tuple(inner), tuple(outer)
+
+
+def transforms(stage):
+    """ Return the declared ``(args, result)`` functions of a HOF ``stage``
+
+    Either may be None.  Returns None if neither is declared.
+    """
+    props = getprops(stage)
+    pre = props.get('args')
+    post = props.get('result')
+    if pre is None and post is None:
+        return None
+    return pre, post
+
+
+def _inverses(a, b):
+    return (getprops(a).get('inverse') is unwrap(b) or
+            getprops(b).get('inverse') is unwrap(a))
+
+
+def _sortkey(item):
+    stage = item[0]
+    return getattr(stage, '__name__', None) or '', id(stage)
+
+
+def _sort(items):
+    # put runs of stages of the same commutative group into a canonical order
+    rv = []
+    run = []
+    group = None
+    for item in items:
+        key = getprops(item[0]).get('commutative')
+        if run and key != group:
+            rv.extend(sorted(run, key=_sortkey))
+            run = []
+        if key is None:
+            rv.append(item)
+        else:
+            run.append(item)
+            group = key
+    rv.extend(sorted(run, key=_sortkey))
+    return rv
+
+
+def _reduce(items):
+    # cancel inverses, collapse idempotent stages, and count fusable stages
+    stack = []
+    for stage, count in items:
+        while count and stack:
+            top, topcount = stack[-1]
+            if _inverses(top, stage):
+                n = min(topcount, count)
+                count -= n
+                if n == topcount:
+                    stack.pop()
+                else:
+                    stack[-1] = (top, topcount - n)
+            elif top is stage and getprops(stage).get('idempotent'):
+                count = 0
+            elif top is stage and getprops(stage).get('fuse') is not None:
+                stack[-1] = (top, topcount + count)
+                count = 0
+            else:
+                break
+        if count:
+            stack.append((stage, count))
+    return stack
+
+
+def simplify(stages):
+    """ Return an equivalent, possibly shorter, tuple of stages
+
+    ``stages`` are in the order they are applied.  Stages without declared
+    properties are never moved or removed.
+    """
+    if not any(isinstance(stage, Declared) for stage in stages):
+        return stages
+    items = [(stage, 1) for stage in stages
+             if not getprops(stage).get('identity')]
+    while True:
+        reduced = _reduce(_sort(items))
+        if reduced == items:
+            break
+        items = reduced
+    return tuple(stage if count == 1 else stage.fused(count)
+                 for stage, count in items)
@@ -0,0 +1,531 @@
+""" Higher-order functions that can be used as metafuncs
+
+>>> from metafunc import metafunc
+>>> from metafunc.hofs import cached
+>>> metafunc('ns', [cached, doubled], [f])  # doctest: +SKIP
+>>> from ns.cached.doubled import f  # doctest: +SKIP
+
+Every metafunc here is declared as ``outer`` (see ``metafunc.declare``),
+so it wraps the whole chain function in both HOF and composition mode,
+wherever it appears in the path.  Outer stages are applied in the order of
+the path, so ``svc.timed.batched.pmap.score`` is
+``pmap(batched(timed(score)))``: the items given to ``score`` are fanned
+out to a pool, coalesced into bulk calls, and each bulk call is timed.
+
+- cached, memoize -- cache the results of the chain
+- pmap, parallel -- call the chain on each item of an iterable in a pool
+- batched, batching -- coalesce concurrent calls into one bulk call
+- timed, timing -- record a histogram of call latencies
+- ratelimit -- a token bucket that limits the rate of calls
+- timeout -- abort calls that take too long
+
+``ratelimit`` and ``timeout`` have no sensible defaults, so their metafuncs
+(named "ratelimited" and "deadline") must be created before use:
+
+>>> metafunc('svc', [timed, ratelimit(100), timeout(0.5)], [score])
+...          # doctest: +SKIP
+"""
+import bisect
+import multiprocessing
+import threading
+import time
+from functools import wraps
+
+from .cache import LRUCache
+from .core import chainrefs, resolve
+from .declare import declare
+from .instrument import clock
+
+try:
+    from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                    ThreadPoolExecutor)
+    from concurrent.futures import TimeoutError as _FutureTimeout
+except ImportError:  # pragma: no cover
+    # Python 2 without the "futures" backport; pmap and timeout need it
+    Executor = ProcessPoolExecutor = ThreadPoolExecutor = None
+    _FutureTimeout = None
+
+try:
+    _TimeoutError = TimeoutError
+except NameError:  # pragma: no cover
+    _TimeoutError = RuntimeError
+
+_missing = object()
+# separates positional and keyword arguments in keys
+_kwmark = (object(),)
+
+
+def _makekey(args, kwargs, typed):
+    key = args
+    if kwargs:
+        key += _kwmark + tuple(sorted(kwargs.items()))
+    if typed:
+        key += tuple(type(val) for val in args)
+        if kwargs:
+            key += tuple(type(kwargs[name]) for name in sorted(kwargs))
+    return key
+
+
+def memoize(maxsize=128, ttl=None, typed=False, name='cached'):
+    """ Return a metafunc that caches the results of chain functions
+
+    Arguments:
+    maxsize (default 128) -- the number of results kept for each chain
+                             function, evicting the least recently used
+                             (None for no limit)
+    ttl (default None) -- seconds after which a result expires
+    typed (default False) -- cache arguments of different types separately,
+                             such as 1 and 1.0
+    name (default 'cached') -- the name of the metafunc
+
+    Each chain function has its own thread-safe cache.  Its ``cache_info()``
+    returns a ``CacheInfo`` of (hits, misses, maxsize, currsize), and
+    ``cache_clear()`` clears it.  Calls with unhashable arguments aren't
+    cached.  Chain functions that return iterators (such as in streaming
+    mode) or awaitables shouldn't be cached.
+    """
+    def memoizer(func):
+        cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            key = _makekey(args, kwargs, typed)
+            try:
+                rv = cache.get(key, _missing)
+            except TypeError:
+                return func(*args, **kwargs)
+            if rv is _missing:
+                rv = func(*args, **kwargs)
+                cache[key] = rv
+            return rv
+        inner.cache_info = cache.info
+        inner.cache_clear = cache.clear
+        return inner
+    memoizer.__name__ = name
+    return declare(memoizer, outer=True, idempotent=True)
+
+
+cached = memoize()
+
+
+def cacheinfo(module):
+    """ Return a dict of the ``CacheInfo`` of each cached function of a module
+
+    Only functions that have been built are included.
+    """
+    rv = {}
+    for funcname in getattr(module, '__all__', ()):
+        func = module.__dict__.get(funcname)
+        if func is not None and hasattr(func, 'cache_info'):
+            rv[funcname] = func.cache_info()
+    return rv
+
+
+class RateLimitExceeded(RuntimeError):
+    """ Raised by a non-blocking ``ratelimit`` metafunc when out of tokens"""
+
+
+class DeadlineExceeded(_TimeoutError):
+    """ Raised by a ``timeout`` metafunc when a call takes too long
+
+    It is a ``TimeoutError``, or a ``RuntimeError`` before Python 3.3.
+    """
+
+
+_executors = {}
+# the size of shared thread pools, which has no default before Python 3.5
+try:
+    _workers = 5 * multiprocessing.cpu_count()
+except NotImplementedError:  # pragma: no cover
+    _workers = 5
+_executorlock = threading.Lock()
+
+
+def _isexecutor(obj):
+    return Executor is not None and isinstance(obj, Executor)
+
+
+def _checkexecutor(kind):
+    if not _isexecutor(kind) and kind not in ('thread', 'process'):
+        raise ValueError('Bad executor: %r (expected "thread", "process" or '
+                         'an Executor)' % (kind,))
+
+
+def _executor(kind, purpose):
+    """ Return the shared executor for ``kind``, or ``kind`` if an Executor
+
+    Pools are shared by every metafunc of the same ``purpose``.  Purposes
+    have separate pools so, for instance, calls waiting on a deadline don't
+    occupy the workers they wait on.
+    """
+    if _isexecutor(kind):
+        return kind
+    if Executor is None:  # pragma: no cover
+        raise ImportError('Shared pools need concurrent.futures (install '
+                          'the "futures" backport on Python 2)')
+    key = (purpose, kind)
+    with _executorlock:
+        executor = _executors.get(key)
+        if executor is None:
+            if kind == 'thread':
+                executor = ThreadPoolExecutor(_workers)
+            else:
+                executor = ProcessPoolExecutor()
+            _executors[key] = executor
+        return executor
+
+
+class _Call(object):
+    """ Call ``func`` with the given arguments followed by fixed arguments
+
+    Unlike a closure, this can be pickled, so it may be sent to a process
+    pool.  A function given to an outer stage of a chain is pickled by the
+    path of its chain (see ``metafunc.core.chainrefs``), and is rebuilt in
+    the worker by ``resolve``.
+    """
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __reduce__(self):
+        try:
+            path = chainrefs.get(self.func)
+        except TypeError:  # pragma: no cover
+            # not weakly referenceable
+            path = None
+        if path is None:
+            return _Call, (self.func, self.args, self.kwargs)
+        return _resolved, (path, self.args, self.kwargs)
+
+    def __call__(self, *args):
+        return self.func(*(args + self.args), **self.kwargs)
+
+
+def _resolved(path, args, kwargs):
+    return _Call(resolve(path), args, kwargs)
+
+
+def parallel(executor='thread', chunksize=1, name='pmap'):
+    """ Return a metafunc that calls the chain on each item of an iterable
+
+    Arguments:
+    executor (default 'thread') -- 'thread' or 'process' for a pool shared
+                                   by every chain function, or an Executor
+    chunksize (default 1) -- items sent to a process pool at a time
+    name (default 'pmap') -- the name of the metafunc
+
+    The chain function ``f`` becomes ``g(items, *args, **kwargs)``, which
+    returns the list of ``f(item, *args, **kwargs)`` for each item in order.
+    The first exception raised by a call is raised.  With a process pool,
+    the arguments must be picklable, and ``f`` is pickled by the path of
+    its chain, so the root must also be created in the workers (as it is
+    when they are forked).
+    """
+    _checkexecutor(executor)
+
+    def pmapper(func):
+        @wraps(func)
+        def inner(items, *args, **kwargs):
+            pool = _executor(executor, name)
+            if isinstance(pool, ProcessPoolExecutor):
+                return list(pool.map(_Call(func, args, kwargs), items,
+                                     chunksize=chunksize))
+            if args or kwargs:
+                return list(pool.map(_Call(func, args, kwargs), items))
+            return list(pool.map(func, items))
+        return inner
+    pmapper.__name__ = name
+    return declare(pmapper, outer=True)
+
+
+pmap = parallel()
+
+
+class _Pending(object):
+    """ A call waiting to be part of a batch"""
+    __slots__ = ('item', 'done', 'result', 'error')
+
+    def __init__(self, item):
+        self.item = item
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class _Batcher(object):
+    """ Coalesce concurrent single calls into bulk calls of ``func``
+
+    The first caller to find no bulk call in progress becomes the leader: it
+    waits up to ``delay`` seconds for the batch to fill, calls ``func`` with
+    the items of up to ``maxsize`` waiting calls, and hands out the results.
+    Calls made meanwhile wait for the next batch.
+    """
+    def __init__(self, func, maxsize, delay):
+        self.func = func
+        self.maxsize = maxsize
+        self.delay = delay
+        self.pending = []
+        self.leading = False
+        self.cond = threading.Condition(threading.Lock())
+        self.batches = 0
+
+    def __call__(self, item):
+        pending = _Pending(item)
+        cond = self.cond
+        with cond:
+            self.pending.append(pending)
+            if len(self.pending) >= self.maxsize:
+                cond.notify_all()
+        while True:
+            with cond:
+                while self.leading and not pending.done:
+                    cond.wait()
+                if pending.done:
+                    break
+                self.leading = True
+                end = clock() + self.delay
+                while len(self.pending) < self.maxsize:
+                    remaining = end - clock()
+                    if remaining <= 0:
+                        break
+                    cond.wait(remaining)
+                batch = self.pending[:self.maxsize]
+                del self.pending[:self.maxsize]
+                self.batches += 1
+            self._run(batch)
+            with cond:
+                self.leading = False
+                cond.notify_all()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _run(self, batch):
+        try:
+            results = list(self.func([pending.item for pending in batch]))
+            if len(results) != len(batch):
+                raise ValueError('Bulk call of %r returned %d results for %d '
+                                 'items' % (self.func, len(results),
+                                            len(batch)))
+        except BaseException as exc:
+            for pending in batch:
+                pending.error = exc
+        else:
+            for pending, result in zip(batch, results):
+                pending.result = result
+        with self.cond:
+            for pending in batch:
+                pending.done = True
+
+
+def batching(maxsize=64, delay=0.005, name='batched'):
+    """ Return a metafunc that coalesces concurrent calls into bulk calls
+
+    Arguments:
+    maxsize (default 64) -- the most items in one bulk call
+    delay (default 0.005) -- seconds to wait for more calls before a bulk
+                             call is made
+    name (default 'batched') -- the name of the metafunc
+
+    The chain function must take a list of items and return a list of as
+    many results.  It becomes a function of a single item, and calls made
+    from different threads are gathered so the chain is called once per
+    batch.  If the bulk call raises, every call in the batch raises.  The
+    number of bulk calls made is the ``batches`` attribute of the
+    ``batcher`` attribute of the new function.
+    """
+    if maxsize < 1:
+        raise ValueError('maxsize must be at least 1, not %r' % (maxsize,))
+
+    def batcher(func):
+        batch = _Batcher(func, maxsize, delay)
+
+        @wraps(func)
+        def inner(item):
+            return batch(item)
+        inner.batcher = batch
+        return inner
+    batcher.__name__ = name
+    return declare(batcher, outer=True)
+
+
+batched = batching()
+
+# upper bounds in seconds of the default histogram buckets
+_buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0,
+            10.0)
+
+
+class Histogram(object):
+    """ A thread-safe histogram of latencies in seconds
+
+    ``counts[i]`` is the number of observations no greater than
+    ``buckets[i]`` (and greater than the previous bound); the last count is
+    of observations greater than every bound.
+    """
+    def __init__(self, buckets=_buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+
+    def snapshot(self):
+        """ Return a dict with cumulative counts, as Prometheus expects"""
+        with self._lock:
+            counts = list(self.counts)
+            rv = {'count': self.count, 'sum': self.sum}
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            cumulative.append((bound, total))
+        rv['buckets'] = cumulative
+        return rv
+
+
+def timing(buckets=_buckets, name='timed'):
+    """ Return a metafunc that records a histogram of call latencies
+
+    Arguments:
+    buckets -- upper bounds in seconds of the histogram buckets
+    name (default 'timed') -- the name of the metafunc
+
+    Each chain function has its own ``Histogram`` as its ``histogram``
+    attribute.  Calls that raise are timed too.
+    """
+    def timer(func):
+        histogram = Histogram(buckets)
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(clock() - start)
+        inner.histogram = histogram
+        return inner
+    timer.__name__ = name
+    return declare(timer, outer=True)
+
+
+timed = timing()
+
+
+class TokenBucket(object):
+    """ A thread-safe token bucket of ``rate`` tokens per second
+
+    It holds at most ``burst`` tokens and starts full.
+    """
+    def __init__(self, rate, burst=None, clock=clock):
+        if rate <= 0:
+            raise ValueError('rate must be positive, not %r' % (rate,))
+        self.rate = float(rate)
+        self.burst = float(max(1, rate) if burst is None else burst)
+        self.tokens = self.burst
+        self._clock = clock
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """ Take a token, or return the seconds until one is available"""
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+def ratelimit(rate, burst=None, block=True, shared=False, name='ratelimited'):
+    """ Return a metafunc that limits the rate of calls with a token bucket
+
+    Arguments:
+    rate -- calls per second
+    burst (default max(1, rate)) -- calls that may be made at once
+    block (default True) -- wait for a token rather than raise
+                            ``RateLimitExceeded``
+    shared (default False) -- use one bucket for every chain function
+                              rather than one each
+    name (default 'ratelimited') -- the name of the metafunc
+
+    The bucket of a chain function is its ``bucket`` attribute.
+    """
+    common = TokenBucket(rate, burst)  # also validates the arguments
+    if not shared:
+        common = None
+
+    def ratelimiter(func):
+        bucket = common or TokenBucket(rate, burst)
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            wait = bucket.take()
+            while wait:
+                if not block:
+                    raise RateLimitExceeded('Rate limit of %r calls per '
+                                            'second exceeded by %r'
+                                            % (rate, func))
+                time.sleep(wait)
+                wait = bucket.take()
+            return func(*args, **kwargs)
+        inner.bucket = bucket
+        return inner
+    ratelimiter.__name__ = name
+    return declare(ratelimiter, outer=True)
+
+
+def timeout(seconds, executor='thread', name='deadline'):
+    """ Return a metafunc that aborts calls taking longer than ``seconds``
+
+    Arguments:
+    seconds -- the most time a call may take
+    executor (default 'thread') -- where calls are run: 'thread' or
+                                   'process' for a shared pool, or an
+                                   Executor
+    name (default 'deadline') -- the name of the metafunc
+
+    A call is run in the executor and ``DeadlineExceeded`` is raised if it
+    doesn't finish in time.  Python can't interrupt a thread, so the call
+    is abandoned rather than stopped: it keeps running in the background,
+    and its result is discarded.  Slow calls therefore still occupy a worker
+    of the pool, so pass a dedicated executor when that matters.
+    """
+    if seconds <= 0:
+        raise ValueError('seconds must be positive, not %r' % (seconds,))
+    _checkexecutor(executor)
+
+    def limiter(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            future = _executor(executor, name).submit(_Call(func, args,
+                                                            kwargs))
+            try:
+                return future.result(seconds)
+            except _FutureTimeout:
+                future.cancel()
+                raise DeadlineExceeded('%r took longer than %r seconds'
+                                       % (func, seconds))
+        return inner
+    limiter.__name__ = name
+    return declare(limiter, outer=True)
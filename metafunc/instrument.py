@@ -0,0 +1,256 @@
+""" Count calls and time the stages of chain functions
+
+Chains are only instrumented if their root was created with
+``metafunc(..., instrument=True)``, so other chains have no overhead.
+For each (module, function) pair, the number of calls, the total time and
+the time of each stage are recorded.  The first stage is the first order
+function itself.
+
+In composition mode, the time of a stage is the time spent in that stage
+alone.  In HOF mode, a stage can't be separated from the functions it
+wraps, so its time includes every stage before it.
+
+In streaming mode, a call only creates the pipeline, so the time of a call
+excludes consuming it.  The time of a stage accumulates as items are
+consumed, except that of ``stream='iter'`` stages, which only includes
+calling the stage with the iterator.
+
+>>> snapshot()  # doctest: +SKIP
+[{'module': 'zmm.comp.inc', 'function': 'one', 'calls': 1,
+  'seconds': 2e-06, 'stages': [['one', 1e-06], ['inc', 1e-06]]}]
+"""
+import inspect
+import json
+import threading
+import time
+from functools import wraps
+
+from .batch import makebatch
+from .compiler import compose_stream, iscoroutinefunction
+from .declare import blocking, streamkinds, unwrap
+
+try:
+    clock = time.perf_counter
+except AttributeError:  # pragma: no cover
+    clock = time.time
+
+_stats = {}
+_lock = threading.Lock()
+
+
+class Stats(object):
+    """ Calls and times of one chain function"""
+    def __init__(self, module, function, stages):
+        self.module = module
+        self.function = function
+        self.names = [getattr(stage, '__name__', None) or repr(stage)
+                      for stage in stages]
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.stages = [0.0] * len(self.names)
+
+    def record(self, seconds, stages=None):
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+            if stages is not None:
+                for i, val in enumerate(stages):
+                    self.stages[i] += val
+
+    def add(self, index, seconds):
+        with self._lock:
+            self.stages[index] += seconds
+
+    def todict(self):
+        with self._lock:
+            return {
+                'module': self.module,
+                'function': self.function,
+                'calls': self.calls,
+                'seconds': self.seconds,
+                'stages': [list(item)
+                           for item in zip(self.names, self.stages)],
+            }
+
+
+def getstats(module, function, stages):
+    """ Return the Stats of a chain function, creating it if necessary"""
+    key = (module, function)
+    with _lock:
+        stats = _stats.get(key)
+        if stats is None or len(stats.names) != len(stages):
+            stats = _stats[key] = Stats(module, function, stages)
+        return stats
+
+
+def build(module, function, func, stages, composition=False, streaming=False):
+    """ Build an instrumented chain of ``stages`` applied to ``func``"""
+    stats = getstats(module, function, (func,) + tuple(stages))
+    orig_func = unwrap(func)
+    funcs = tuple(map(unwrap, stages))
+    if composition and not streaming:
+        if any(map(iscoroutinefunction, (orig_func,) + funcs)):
+            return _build_async(stats, orig_func, funcs, blocking(stages))
+
+        def inner(*args, **kwargs):
+            times = []
+            start = prev = clock()
+            try:
+                rv = orig_func(*args, **kwargs)
+                for stage in funcs:
+                    now = clock()
+                    times.append(now - prev)
+                    prev = now
+                    rv = stage(rv)
+                return rv
+            finally:
+                now = clock()
+                times.append(now - prev)
+                stats.record(now - start, times)
+        inner.batch = makebatch(func, stages)
+        return inner
+
+    def timed(func, index):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.add(index, clock() - start)
+        return inner
+
+    if streaming:
+        outer = compose_stream(timed(orig_func, 0),
+                               [timed(stage, i + 1)
+                                for i, stage in enumerate(funcs)],
+                               streamkinds(stages))
+    else:
+        rv = timed(orig_func, 0)
+        for i, stage in enumerate(funcs):
+            rv = timed(stage(rv), i + 1)
+        outer = rv
+
+    @wraps(outer)
+    def counted(*args, **kwargs):
+        start = clock()
+        try:
+            return outer(*args, **kwargs)
+        finally:
+            stats.record(clock() - start)
+    return counted
+
+
+_async_source = """
+async def inner(*args, **kwargs):
+    times = []
+    start = prev = clock()
+    try:
+        rv = orig_func(*args, **kwargs)
+        if isawaitable(rv):
+            rv = await rv
+        for i, stage in enumerate(funcs):
+            now = clock()
+            times.append(now - prev)
+            prev = now
+            if i in blocking:
+                rv = await loop().run_in_executor(blocking[i], stage, rv)
+            else:
+                rv = stage(rv)
+            if isawaitable(rv):
+                rv = await rv
+        return rv
+    finally:
+        now = clock()
+        times.append(now - prev)
+        stats.record(now - start, times)
+"""
+
+
+def _build_async(stats, orig_func, funcs, blocking):
+    # Composition chain of coroutine functions.  The source is compiled
+    # here so that this module can be imported without "async" support.
+    import asyncio
+    namespace = {'clock': clock, 'isawaitable': inspect.isawaitable,
+                 'orig_func': orig_func, 'funcs': funcs, 'stats': stats,
+                 'blocking': blocking,
+                 'loop': getattr(asyncio, 'get_running_loop',
+                                 asyncio.get_event_loop)}
+    exec(compile(_async_source, '<metafunc>', 'exec'), namespace)
+    return namespace['inner']
+
+
+def snapshot():
+    """ Return a list of dicts of the stats of every instrumented function"""
+    with _lock:
+        stats = sorted(_stats.values(), key=lambda s: (s.module, s.function))
+    return [item.todict() for item in stats]
+
+
+def reset():
+    """ Reset the counts and times of every instrumented function"""
+    with _lock:
+        stats = list(_stats.values())
+    for item in stats:
+        with item._lock:
+            item.reset()
+
+
+def discard(module_names):
+    """ Remove the stats of every function of the given modules"""
+    module_names = set(module_names)
+    with _lock:
+        for key in [key for key in _stats if key[0] in module_names]:
+            del _stats[key]
+
+
+def tojson(stats=None, **kwargs):
+    """ Dump a snapshot as JSON; ``kwargs`` are passed to ``json.dumps``"""
+    if stats is None:
+        stats = snapshot()
+    return json.dumps(stats, **kwargs)
+
+
+def _label(value):
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return '"%s"' % value.replace('\n', '\\n')
+
+
+def toprometheus(stats=None, prefix='metafunc'):
+    """ Dump a snapshot in the Prometheus text exposition format"""
+    if stats is None:
+        stats = snapshot()
+    calls = []
+    seconds = []
+    stage_seconds = []
+    for item in stats:
+        labels = 'module=%s,function=%s' % (_label(item['module']),
+                                            _label(item['function']))
+        calls.append('%s_calls_total{%s} %d' % (prefix, labels, item['calls']))
+        seconds.append('%s_seconds_total{%s} %r' % (prefix, labels,
+                                                    item['seconds']))
+        for i, (name, val) in enumerate(item['stages']):
+            stage_seconds.append('%s_stage_seconds_total{%s,stage=%s,'
+                                 'position="%d"} %r' % (prefix, labels,
+                                                        _label(name), i, val))
+    lines = [
+        '# HELP %s_calls_total Number of calls of a chain function' % prefix,
+        '# TYPE %s_calls_total counter' % prefix,
+    ]
+    lines.extend(calls)
+    lines.extend([
+        '# HELP %s_seconds_total Time spent in a chain function' % prefix,
+        '# TYPE %s_seconds_total counter' % prefix,
+    ])
+    lines.extend(seconds)
+    lines.extend([
+        '# HELP %s_stage_seconds_total Time spent in a stage of a chain '
+        'function' % prefix,
+        '# TYPE %s_stage_seconds_total counter' % prefix,
+    ])
+    lines.extend(stage_seconds)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,205 @@
+import imp
+import os
+import shutil
+import sys
+import tempfile
+from metafunc.aot import _reference, generate
+from metafunc.core import metafunc, MetaModule
+from metafunc.declare import declare
+from metafunc.utils import raises
+from zmm import coroutines
+from zmm.firstorder import one, two, inc, double, triple
+from zmm.higherorder import doubled, tripled
+
+
+def add(x, y=10, *args, **kwargs):
+    return x + y
+
+
+def sub(x, y=object()):
+    return x
+
+
+def odd(x):
+    return x % 2
+
+
+def fuse(k):
+    return lambda x: x + k
+
+
+def pairs(it):
+    return zip(it, it)
+
+
+def declared_inc(x):
+    return x + 1
+
+
+class Stages(object):
+    @staticmethod
+    def halve(x):
+        return x // 2
+
+
+logs = []
+
+
+def logged(f):
+    # records whether it decorates a chain rather than the function itself
+    def inner(*args, **kwargs):
+        logs.append(hasattr(f, '__wrapped__'))
+        return f(*args, **kwargs)
+    return inner
+
+
+def cleanup(tmpdir, *packages):
+    """ Remove generated packages from disk, sys.path and sys.modules"""
+    shutil.rmtree(tmpdir)
+    if tmpdir in sys.path:
+        sys.path.remove(tmpdir)
+    for name in list(sys.modules):
+        if name.partition('.')[0] in packages:
+            del sys.modules[name]
+
+
+def test_generate():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sys.modules['aotsrc'] = imp.new_module('aotsrc')
+        metafunc('aotsrc.comp',
+                 [declare(declared_inc, fuse=fuse), double,
+                  declare(triple, blocking=True)],
+                 [one, add, sub], composition=True)
+        metafunc('aotsrc.hofs', [doubled, tripled], [one, two])
+        metafunc('aotsrc.stream', [inc, declare(odd, stream='filter'),
+                                   declare(pairs, stream='iter')],
+                 [range], streaming=True)
+        path = generate('aotsrc.comp', tmpdir, depth=1,
+                        paths=['declared_inc.declared_inc.double'],
+                        package='aotcomp')
+        assert path == os.path.join(tmpdir, 'aotcomp')
+        generate('aotsrc.hofs', tmpdir, paths=[['doubled', 'tripled']],
+                 package='aothofs',
+                 compile=False)
+        generate(sys.modules['aotsrc.stream'], tmpdir, depth=2,
+                 package='aotstream')
+        sys.path.insert(0, tmpdir)
+        import aotcomp.declared_inc.declared_inc.double as mod
+        assert not isinstance(mod, MetaModule)
+        assert mod.one() == 6
+        assert mod.add(1) == 26
+        assert mod.add(1, 2, 3) == 10
+        assert mod.sub(4) == 12
+        assert mod.__all__ == ['add', 'one', 'sub']
+        import aotcomp.triple
+        assert aotcomp.triple.one() == 3
+        assert aotcomp.one is one
+        import aothofs.doubled.tripled
+        assert aothofs.doubled.tripled.one() == 6
+        assert aothofs.doubled.two() == 4
+        import aotstream.inc.odd
+        import aotstream.inc.pairs
+        assert list(aotstream.inc.odd.range(5)) == [1, 3, 5]
+        assert list(aotstream.inc.pairs.range(4)) == [(1, 2), (3, 4)]
+        assert raises(ValueError, lambda: generate('aotsrc', tmpdir))
+        assert raises(ValueError, lambda: generate('aotsrc.hofs', tmpdir,
+                                                   paths=['tripled.bad']))
+        metafunc('aotsrc.bad', [lambda f: f], [one])
+        assert raises(ValueError, lambda: generate('aotsrc.bad', tmpdir))
+    finally:
+        cleanup(tmpdir, 'aotcomp', 'aothofs', 'aotstream')
+
+
+def test_generate_async():
+    if not coroutines.supported:  # pragma: no cover
+        return
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sys.modules['aotasync'] = imp.new_module('aotasync')
+        metafunc('aotasync.comp',
+                 [declare(declared_inc, fuse=fuse), double,
+                  declare(triple, blocking=True)],
+                 [coroutines.aone], composition=True)
+        generate('aotasync.comp', tmpdir, depth=1,
+                 paths=['declared_inc.declared_inc.double'],
+                 package='aotasynccomp')
+        sys.path.insert(0, tmpdir)
+        import aotasynccomp.declared_inc.declared_inc.double as mod
+        assert coroutines.run(mod.aone()) == 6
+        import aotasynccomp.triple
+        assert coroutines.run(aotasynccomp.triple.aone()) == 3
+        metafunc('aotasync.executor',
+                 [declare(triple, blocking=sys.modules['aotasync'])],
+                 [coroutines.aone], composition=True)
+        assert raises(ValueError, lambda: generate('aotasync.executor',
+                                                   tmpdir, depth=1))
+    finally:
+        cleanup(tmpdir, 'aotasynccomp')
+
+
+def test_outer():
+    outer = declare(logged, outer=True)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sys.modules['aotouter'] = imp.new_module('aotouter')
+        metafunc('aotouter.comp', [inc, double, outer], [one],
+                 composition=True)
+        metafunc('aotouter.hofs', [doubled, tripled, outer], [one])
+        generate('aotouter.comp', tmpdir, paths=['inc.logged.double'],
+                 package='aotoutercomp')
+        generate('aotouter.hofs', tmpdir, paths=['logged.doubled.tripled'],
+                 package='aotouterhofs')
+        sys.path.insert(0, tmpdir)
+        import aotoutercomp.inc.logged.double as mod
+        assert mod.one() == 4
+        assert logs == [False]
+        import aotouterhofs.logged.doubled.tripled as mod
+        del logs[:]
+        assert mod.one() == 6
+        runtime = sys.modules['aotouter'].hofs.logged.doubled.tripled
+        assert runtime.one() == 6
+        assert logs == [True, True]
+    finally:
+        cleanup(tmpdir, 'aotoutercomp', 'aotouterhofs')
+
+
+def test_reference():
+    assert _reference(Stages.halve) == (__name__, 'Stages.halve')
+    assert _reference(lambda x: x) is None
+    renamed = Stages()
+    renamed.__module__ = __name__
+    renamed.__qualname__ = 'add'
+    assert _reference(renamed) is None
+    missing = Stages()
+    missing.__module__ = 'aotmissing'
+    missing.__qualname__ = 'missing'
+    assert _reference(missing) is None
+    # nested names are imported from their outermost object
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sys.modules['aotref'] = imp.new_module('aotref')
+        metafunc('aotref.comp', [Stages.halve], [two], composition=True)
+        generate('aotref.comp', tmpdir, depth=1, package='aotrefcomp')
+        sys.path.insert(0, tmpdir)
+        import aotrefcomp.halve
+        assert aotrefcomp.halve.two() == 1
+    finally:
+        cleanup(tmpdir, 'aotrefcomp')
+
+
+def test_reversed():
+    # fused stages can't be imported, so the original stages are used
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sys.modules['aotrev'] = imp.new_module('aotrev')
+        metafunc('aotrev.comp', [declare(declared_inc, fuse=fuse), double],
+                 [one], composition=True, reverse=True)
+        generate('aotrev.comp', tmpdir,
+                 paths=['double.declared_inc.declared_inc'],
+                 package='aotrevcomp')
+        sys.path.insert(0, tmpdir)
+        import aotrevcomp.double.declared_inc.declared_inc as mod
+        assert mod.one() == 6
+    finally:
+        cleanup(tmpdir, 'aotrevcomp')
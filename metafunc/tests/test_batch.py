@@ -0,0 +1,30 @@
+from metafunc.batch import batchcall, makebatch, numpy
+from metafunc.declare import declare
+from zmm.firstorder import inc, double, triple, identity
+
+
+def add(x, y=0):
+    return x + y
+
+
+def test_batchcall():
+    assert batchcall(identity, [inc, double], [1, 2, 3]) == [4, 6, 8]
+    assert batchcall(add, [triple], (1, 2), 1) == [6, 9]
+    assert batchcall(add, [triple], iter([1, 2]), y=2) == [9, 12]
+    vinc = declare(inc, vectorize=True)
+    assert batchcall(declare(identity, vectorize=True), [vinc, double],
+                     [1, 2]) == [4, 6]
+    batch = makebatch(add, [inc])
+    assert batch.__name__ == 'add'
+    assert batch([1, 2], 10) == [12, 13]
+
+
+def test_numpy():
+    if numpy is None:  # pragma: no cover
+        return
+    vdouble = declare(double, vectorize=True)
+    rv = batchcall(identity, [vdouble, inc], numpy.arange(3))
+    assert isinstance(rv, numpy.ndarray)
+    assert rv.tolist() == [1, 3, 5]
+    rv = batchcall(declare(identity, vectorize=True), [vdouble], [1, 2])
+    assert rv == [2, 4]
@@ -0,0 +1,57 @@
+from metafunc.cache import LRUCache
+
+
+def test_lru():
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('b', 0) == 0
+    assert len(cache) == 2
+    assert cache.info() == (1, 2, 2, 2)
+    cache.resize(1)
+    assert list(cache._data) == ['c']
+    assert cache.maxsize == 1
+    cache.clear()
+    assert cache.info() == (0, 0, 1, 0)
+
+
+def test_unbounded_and_disabled():
+    cache = LRUCache(maxsize=None)
+    for i in range(1000):
+        cache[i] = i
+    assert len(cache) == 1000
+    cache = LRUCache(maxsize=0)
+    cache['a'] = 1
+    assert 'a' not in cache
+
+
+def test_ttl():
+    now = [0.0]
+    cache = LRUCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    assert cache.ttl == 10
+    cache['a'] = 1
+    now[0] = 5
+    cache['b'] = 2
+    assert 'a' in cache
+    assert cache.get('a') == 1
+    now[0] = 10
+    assert 'a' not in cache
+    assert cache.get('a') is None
+    assert 'a' not in cache._data
+    assert cache.get('b') == 2
+    now[0] = 15
+    assert cache.get('b', 0) == 0
+    assert cache.info() == (2, 2, 2, 0)
+
+
+def test_discard():
+    cache = LRUCache()
+    for i in range(10):
+        cache[i] = i
+    cache.discard(lambda key: key % 2)
+    assert list(cache._data) == [0, 2, 4, 6, 8]
@@ -0,0 +1,173 @@
+import sys
+from metafunc.compiler import (compose, compose_async, compose_many,
+                               compose_stream, compose_wrapper,
+                               iscoroutinefunction)
+from metafunc.core import _compose
+from metafunc.utils import raises
+from zmm import coroutines
+from zmm.firstorder import one, inc, double, triple
+
+
+def add(x, y=10):
+    """ Add two numbers"""
+    return x + y
+
+
+def varargs(x, *args, **kwargs):
+    return x + sum(args) + sum(kwargs.values())
+
+
+# Keyword-only parameters need Python 3 and positional-only parameters need
+# Python 3.8, so these functions are compiled where they are supported
+_kwonly = """
+def kwonly(x, *, y, z=3):
+    return x + y + z
+"""
+
+_posonly = """
+def posonly(x, y=1, /, z=2):
+    return x + y + z
+
+
+def onlyposonly(x, y=1, /):
+    return x + y
+"""
+
+if sys.version_info[0] >= 3:
+    exec(compile(_kwonly, __file__, 'exec'))
+if sys.version_info >= (3, 8):
+    exec(compile(_posonly, __file__, 'exec'))
+
+
+def test_compose():
+    f = compose(one, [inc, double])
+    assert f() == 4
+    assert f.__name__ == 'one'
+    f = compose(add, [triple])
+    assert f(1) == 33
+    assert f(1, 2) == 9
+    assert f(x=1, y=2) == 9
+    assert f.__doc__ == add.__doc__
+    assert f.__module__ == add.__module__
+    assert compose(add, [])(1, 1) == 2
+
+
+def test_signatures():
+    f = compose(varargs, [double])
+    assert f(1, 2, 3, a=4) == 20
+
+
+def test_keyword_only():
+    if sys.version_info[0] < 3:  # pragma: no cover
+        return
+    f = compose(kwonly, [inc])
+    assert f(1, y=2) == 7
+    assert f(1, y=2, z=0) == 4
+
+
+def test_positional_only():
+    if sys.version_info < (3, 8):  # pragma: no cover
+        return
+    f = compose(posonly, [inc])
+    assert f(1) == 5
+    assert f(1, 0, z=0) == 2
+    f = compose(onlyposonly, [double])
+    assert f(1) == 4
+    assert raises(TypeError, lambda: f(x=1))
+
+
+def test_bad_signature():
+    assert compose(max, [inc]) is None
+
+    def _mf_clash(_mf_f):
+        return _mf_f
+    assert compose(_mf_clash, [inc]) is None
+    # chains fall back to the generic composition
+    assert _compose(_mf_clash, [inc], compiled=True)(1) == 2
+
+
+def test_compose_stream():
+    def odd(x):
+        return x % 2
+
+    def pairs(it):
+        return zip(it, it)
+    f = compose_stream(range, [inc, odd, double], ['map', 'filter', 'map'])
+    rv = f(5)
+    assert iter(rv) is rv
+    assert list(rv) == [2, 6, 10]
+    assert f.__name__ == 'range'
+    f = compose_stream(range, [pairs, sum], ['iter', 'map'])
+    assert list(f(6)) == [1, 5, 9]
+    assert list(compose_stream(add, [], [])([1], y=[2, 3])) == [1, 2, 3]
+    seen = []
+
+    def record(x):
+        seen.append(x)
+        return x
+    rv = compose_stream(range, [record], ['map'])(10 ** 9)
+    assert seen == []
+    assert next(rv) == 0
+    assert next(rv) == 1
+    assert seen == [0, 1]
+    assert raises(ValueError, lambda: compose_stream(range, [inc], ['bad']))
+
+
+def test_compose_many():
+    trie = [{inc: [{double: [{}, ['a', 'b']], triple: [{}, ['c']]}, []]},
+            ['d']]
+    f = compose_many([(add, trie), (min, [{}, ['e']])], [('f', max)])
+    assert f(1, 2) == {'a': 8, 'b': 8, 'c': 12, 'd': 3, 'e': 1, 'f': 2}
+    assert compose_many([], [])() == {}
+
+
+def test_compose_async():
+    import threading
+    if not coroutines.supported:  # pragma: no cover
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    aone = coroutines.aone
+    adouble = coroutines.adouble
+    f = compose_async(aone, [inc, adouble, triple])
+    assert iscoroutinefunction(f)
+    assert f.__name__ == 'aone'
+    assert coroutines.run(f()) == 12
+    f = compose_async(add, [adouble])
+    assert coroutines.run(f(1, y=2)) == 6
+    f = compose_async(max, [adouble])
+    assert coroutines.run(f(1, 2)) == 4
+    threads = []
+
+    def blocking(x):
+        threads.append(threading.current_thread())
+        return x + 1
+    with ThreadPoolExecutor(1) as executor:
+        f = compose_async(aone, [blocking, blocking],
+                          {0: None, 1: executor})
+        assert coroutines.run(f()) == 3
+    assert threading.current_thread() not in threads
+    assert len(threads) == 2
+    assert not iscoroutinefunction(one)
+
+
+def test_compose_wrapper():
+    import inspect
+
+    def scale(args, kwargs):
+        return (args[0] * 10,) + args[1:], kwargs
+
+    def shift(args, kwargs):
+        return (args[0] + 1,) + args[1:], kwargs
+    f = compose_wrapper(add, [(None, double), (None, inc)])
+    assert f(1) == 23
+    assert f(1, y=0) == 3
+    assert f.__name__ == 'add'
+    assert f.__doc__ == add.__doc__
+    assert f.__wrapped__ is add
+    assert str(inspect.signature(f)) == '(x, y=10)'
+    # the outermost stage transforms the arguments first
+    f = compose_wrapper(add, [(scale, None), (shift, triple)])
+    assert f(1) == 3 * (20 + 10)
+    assert f(1, y=0) == 60
+    f = compose_wrapper(varargs, [(shift, None), (None, double)])
+    assert f(1, 2, z=3) == 2 * (2 + 2 + 3)
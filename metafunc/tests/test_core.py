@@ -1,7 +1,11 @@
 import imp
 import sys
-from metafunc.core import metafunc, addfuncs, addmetafuncs
+from metafunc.core import (metafunc, addfuncs, addmetafuncs, chaincache,
+                           evaluate, evaluator, prefetch, resolve,
+                           resolvecache, unload, ModuleLoader, Template)
+from metafunc.declare import declare
 from metafunc.utils import raises
+from zmm import coroutines
 from zmm.firstorder import one, two, three, inc, double, triple, identity
 from zmm.higherorder import incremented, doubled, tripled, identified
 
@@ -10,6 +14,24 @@ fofs1 = [one, two, three, identity]
 hofs1 = [inc, double, triple]
 
 
+def forkpool(nworkers):
+    """ A process pool whose workers are forked, so they have every root"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    if sys.version_info < (3, 7):  # pragma: no cover
+        # pools use the default start method, which forks on POSIX
+        return ProcessPoolExecutor(nworkers)
+    return ProcessPoolExecutor(
+        nworkers, mp_context=multiprocessing.get_context('fork'))
+
+
+def shares(f, g):
+    """ Whether two chain functions are copies of the same built function"""
+    def cells(func):
+        return [id(cell) for cell in func.__closure__ or ()]
+    return f.__code__ is g.__code__ and cells(f) == cells(g)
+
+
 def test_composed():
     metafunc('zmm.comp', hofs1, fofs1, composition=True, reverse=False)
     # (1) check simple import
@@ -295,14 +317,43 @@ def test_module_loader():
     sys.modules['empty4'] = imp.new_module('empty4')
     metafunc('empty4.comp', hofs1, fofs1, composition=True)
     import empty4.comp.inc
-    tested = 0
-    for item in sys.meta_path:
-        if hasattr(item, 'find_module'):
-            loader = item.find_module('empty4.comp.inc')
-            if loader:
-                assert empty4.comp.inc is loader.load_module('empty4.comp.inc')
-                tested += 1
-    assert tested > 0
+    loaders = [item for item in sys.meta_path
+               if isinstance(item, ModuleLoader)]
+    assert len(loaders) == 1
+    loader = loaders[0]
+    spec = loader.find_spec('empty4.comp.inc')
+    assert spec is empty4.comp.inc.__spec__
+    assert spec.loader is loader
+    assert spec.submodule_search_locations == []
+    assert loader.find_spec('empty4.comp.inc.inc') is not None
+    assert loader.find_spec('empty4.comp.foo') is None
+    assert loader.find_spec('empty4.foo.inc') is None
+    spec = loader.find_spec('empty4.comp.double.inc')
+    assert spec is loader.find_spec('empty4.comp.double.inc')
+    module = loader.create_module(spec)
+    loader.exec_module(module)
+    assert module is empty4.comp.double.inc
+    assert module.__spec__ is spec
+    # legacy loader protocol
+    assert loader.find_module('empty4.comp.inc') is loader
+    assert empty4.comp.inc is loader.load_module('empty4.comp.inc')
+    assert empty4.comp.triple is loader.load_module('empty4.comp.triple')
+    assert 'empty4.comp.triple.inc' not in sys.modules
+    module = loader.load_module('empty4.comp.triple.inc')
+    assert module is empty4.comp.triple.inc
+    assert loader.find_module('empty4.comp.foo') is None
+
+
+def test_single_module_loader():
+    sys.modules['empty12'] = imp.new_module('empty12')
+    metafunc('empty12.comp', hofs1, fofs1, composition=True)
+    num_finders = len(sys.meta_path)
+    from empty12.comp.inc.double.triple.inc.double import one
+    assert one() == 26
+    metafunc('empty12.comp2', hofs1, fofs1, composition=True)
+    import empty12
+    assert empty12.comp2.inc.inc.inc.one() == 4
+    assert len(sys.meta_path) == num_finders
 
 
 def test_dunder_all():
@@ -364,6 +415,13 @@ def test_add_hofs():
                                                    triple))
     addmetafuncs('empty9.comp.inc.inc', triple)
     assert empty9.comp.triple.one() == 3
+    # the source module of a hidden root gets the new modules right away
+    sys.modules['empty36'] = imp.new_module('empty36')
+    import empty36
+    metafunc('empty36', inc, one, composition=True)
+    addmetafuncs('empty36', double)
+    assert 'double' in vars(empty36)
+    assert empty36.double.inc.one() == 3
 
 
 def test_metafunc_on_metamodules():
@@ -397,3 +455,803 @@ def test_fofs_and_hofs_dont_intersect():
     sys.modules['empty11'] = imp.new_module('empty11')
     assert raises(ValueError, lambda: metafunc('empty11.comp', [one, inc],
                                                inc, composition=True))
+
+
+def test_lazy():
+    sys.modules['empty13'] = imp.new_module('empty13')
+    metafunc('empty13.comp', hofs1, fofs1, composition=True, lazy=True)
+    import empty13
+    assert 'inc' not in vars(empty13.comp)
+    from empty13.comp.inc.double import one, two
+    assert one() == 4
+    assert two() == 6
+    assert 'one' in vars(empty13.comp.inc.double)
+    assert 'three' not in vars(empty13.comp.inc.double)
+    assert empty13.comp.inc.double.three() == 8
+    assert 'three' in vars(empty13.comp.inc.double)
+    assert empty13.comp.triple.triple.one() == 9
+    assert 'one' in dir(empty13.comp.inc)
+    assert 'double' in dir(empty13.comp.inc)
+    assert 'one' not in vars(empty13.comp.inc)
+    assert raises(AttributeError, lambda: empty13.comp.inc.foo)
+    addfuncs('empty13.comp', [('four', lambda: 4)])
+    assert empty13.comp.inc.double.four() == 10
+    addmetafuncs('empty13.comp', [('halve', lambda x: x // 2)])
+    assert 'halve' not in vars(empty13.comp)
+    from empty13.comp.halve import four
+    assert four() == 2
+
+
+def test_lazy_hof():
+    metafunc('zmm.lhofs', hofs2, fofs2, lazy=True)
+    from zmm.lhofs.doubled.tripled import one
+    assert one() == 6
+    import zmm
+    assert zmm.lhofs.incremented.doubled.one() == 4
+    metafunc('lhofs', hofs2, fofs2, lazy=True)
+    import lhofs
+    assert lhofs.tripled.one() == 3
+    from lhofs.tripled import two
+    assert two() == 6
+
+
+def test_lazy_mirror_module():
+    sys.modules['empty14'] = imp.new_module('empty14')
+    metafunc('empty14', hofs1, fofs1, composition=True, lazy=True)
+    import empty14
+    assert empty14.double.triple.one() == 6
+    from empty14.inc.inc import two
+    assert two() == 4
+
+
+def test_incremental_chain():
+    applied = []
+
+    def counted(f):
+        applied.append(f)
+        return doubled(f)
+
+    sys.modules['empty15'] = imp.new_module('empty15')
+    metafunc('empty15.hofs', counted, one, lazy=True)
+    from empty15.hofs.counted.counted.counted.counted import one as sixteen
+    assert sixteen() == 16
+    assert len(applied) == 4
+    import empty15
+    assert empty15.hofs.counted.counted.counted.counted.counted.one() == 32
+    assert len(applied) == 5
+    metafunc('empty15.rhofs', counted, one, lazy=True, reverse=True)
+    del applied[:]
+    chaincache.clear()
+    assert empty15.rhofs.counted.counted.counted.one() == 8
+    assert len(applied) == 3
+
+
+def test_compiled():
+    sys.modules['empty16'] = imp.new_module('empty16')
+    metafunc('empty16.comp', hofs1, fofs1 + [max], composition=True,
+             compiled=True)
+    metafunc('empty16.rcomp', hofs1, fofs1, composition=True, compiled=True,
+             reverse=True)
+    from empty16.comp.inc.double import one, identity
+    assert one() == 4
+    assert identity(1) == 4
+    assert identity(x=2) == 6
+    import empty16
+    assert empty16.comp.inc.double.max(1, 2) == 6
+    from empty16.rcomp.inc.double import one
+    assert one() == 3
+
+
+def test_chaincache():
+    applied = []
+
+    def counted(f):
+        applied.append(f)
+        return tripled(f)
+
+    sys.modules['empty17'] = imp.new_module('empty17')
+    metafunc('empty17.hofs', [counted, doubled], [one, two])
+    metafunc('empty17.hofs2', [counted, doubled], [one, two])
+    import empty17
+    assert len(applied) == 2
+    assert shares(empty17.hofs.counted.one, empty17.hofs2.counted.one)
+    assert shares(empty17.hofs.doubled.counted.one,
+                  empty17.hofs2.doubled.counted.one)
+    assert empty17.hofs2.doubled.counted.one() == 6
+    assert len(applied) == 4
+    metafunc('empty17.comp', hofs1, fofs1, composition=True)
+    metafunc('empty17.comp2', hofs1, fofs1, composition=True)
+    assert shares(empty17.comp.inc.double.one, empty17.comp2.inc.double.one)
+    assert not shares(empty17.comp.inc.double.one,
+                      empty17.comp.double.inc.one)
+    info = chaincache.info()
+    assert info.currsize > 0 and info.hits > 0
+    # unhashable functions aren't cached
+    metafunc('empty17.unhashable', [Unhashable(double)], one, composition=True)
+    metafunc('empty17.unhashable2', [Unhashable(doubled)], one)
+    assert empty17.unhashable.double.double.one() == 4
+    assert empty17.unhashable2.doubled.doubled.one() == 4
+
+
+class Unhashable(object):
+    __hash__ = None
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+
+    def __call__(self, *args):
+        return self.func(*args)
+
+
+def test_declared_metafuncs():
+    def dec(x):
+        return x - 1
+    fuse_calls = []
+
+    def fuse(k):
+        fuse_calls.append(k)
+        return lambda x: x + k
+
+    cinc = declare(inc, inverse=dec, fuse=fuse)
+    sys.modules['empty18'] = imp.new_module('empty18')
+    metafunc('empty18.comp', [cinc, dec, double,
+                              declare(identity, identity=True)],
+             [one, two], composition=True)
+    import empty18
+    assert empty18.comp.inc.inc.inc.inc.one() == 5
+    assert 4 in fuse_calls
+    assert empty18.comp.inc.identity.dec.one is one
+    assert empty18.comp.inc.double.identity.dec.one() == 3
+    assert empty18.comp.inc.inc.double.inc.dec.one() == 6
+    assert empty18.comp.inc.inc.inc.inc.dec.two() == 5
+    assert sorted(fuse_calls) == [2, 3, 4]
+    hofs = [declare(identified, identity=True),
+            declare(doubled, fuse=lambda k: lambda f: lambda: 2 ** k * f())]
+    metafunc('empty18.hofs', hofs, one)
+    assert empty18.hofs.identified.doubled.identified.doubled.one() == 4
+    assert empty18.hofs.identified.one is one
+
+
+def test_batch():
+    sys.modules['empty19'] = imp.new_module('empty19')
+    metafunc('empty19.comp', hofs1, fofs1, composition=True)
+    metafunc('empty19.ccomp', hofs1, fofs1, composition=True, compiled=True)
+    import empty19
+    assert empty19.comp.triple.double.identity.batch(range(3)) == [0, 6, 12]
+    assert empty19.ccomp.inc.identity.batch([1, 2]) == [2, 3]
+    # a batch would bypass outer stages
+    from metafunc.hofs import cached
+    keep = ('keep', declare(lambda f: f, outer=True))
+    metafunc('empty19.outer', hofs1 + [cached, keep], fofs1,
+             composition=True)
+    metafunc('empty19.inst', hofs1 + [cached], fofs1, composition=True,
+             instrument=True)
+    assert empty19.outer.cached.inc.identity(1) == 2
+    assert not hasattr(empty19.outer.cached.inc.identity, 'batch')
+    assert not hasattr(empty19.inst.cached.inc.identity, 'batch')
+    assert empty19.outer.keep.inc.identity.batch([1, 2]) == [2, 3]
+
+
+def test_instrument():
+    from metafunc.instrument import snapshot
+    sys.modules['empty20'] = imp.new_module('empty20')
+    metafunc('empty20.comp', hofs1, fofs1, composition=True, instrument=True)
+    metafunc('empty20.hofs', hofs2, fofs2, instrument=True, lazy=True)
+    from empty20.comp.inc.double import one
+    assert one() == 4
+    from empty20.hofs.doubled.tripled import two
+    assert two() == 12
+    stats = dict(((item['module'], item['function']), item)
+                 for item in snapshot())
+    assert stats['empty20.comp.inc.double', 'one']['calls'] == 1
+    assert stats['empty20.comp.inc.double', 'two']['calls'] == 0
+    assert stats['empty20.hofs.doubled.tripled', 'two']['calls'] == 1
+
+
+def test_incremental_addfuncs():
+    sys.modules['empty21'] = imp.new_module('empty21')
+    metafunc('empty21.comp', hofs1, [one, two], composition=True)
+    import empty21
+    node = empty21.comp.inc.double
+    version = empty21.comp._version
+    assert 'one' in vars(node)
+    assert sorted(node.__all__) == ['one', 'two']
+    addfuncs('empty21.comp', three)
+    assert empty21.comp._version == version + 1
+    # existing modules build new functions upon first access
+    assert 'three' not in vars(node)
+    assert sorted(node.__all__) == ['one', 'three', 'two']
+    assert node.three() == 8
+    assert 'three' in vars(node)
+    # new modules are eager
+    assert 'three' in vars(empty21.comp.triple.inc)
+    assert empty21.comp._node.children['triple'].children['inc'].module is (
+        empty21.comp.triple.inc)
+    # replace functions
+    assert raises(ValueError, lambda: addfuncs('empty21.comp', [('one', two)]))
+    addfuncs('empty21.comp', [('one', two), ('two', two)], replace=True)
+    assert 'one' not in vars(node)
+    assert 'two' in vars(node)
+    assert node.one() == 6
+    assert empty21.comp.one() == 2
+    ns = {}
+    exec('from empty21.comp.inc.double import *', ns)
+    assert sorted(name for name in ns if not name.startswith('__')) == [
+        'one', 'three', 'two']
+    # functions replaced while being built aren't stored
+    replaced = []
+
+    def replacing(f):
+        if not replaced:
+            replaced.append(f)
+            addfuncs('empty21.hofs', [('one', two)], replace=True)
+        return doubled(f)
+
+    metafunc('empty21.hofs', [replacing], [one], lazy=True)
+    assert empty21.hofs.replacing.one() == 4
+    assert replaced == [one]
+    assert empty21.hofs.replacing.__dict__['one']() == 4
+
+
+def test_async():
+    import inspect
+    if not coroutines.supported:  # pragma: no cover
+        return
+    aone = coroutines.aone
+    adouble = coroutines.adouble
+    sys.modules['empty22'] = imp.new_module('empty22')
+    metafunc('empty22.comp', [inc, adouble, declare(triple, blocking=True)],
+             [one, aone], composition=True)
+    import empty22
+    f = empty22.comp.inc.triple.aone
+    assert inspect.iscoroutinefunction(f)
+    assert coroutines.run(f()) == 6
+    f = empty22.comp.adouble.inc.one
+    assert inspect.iscoroutinefunction(f)
+    assert coroutines.run(f()) == 3
+    assert empty22.comp.triple.inc.one() == 4
+    assert not hasattr(empty22.comp.inc.aone, 'batch')
+
+
+def test_streaming():
+    def odd(x):
+        return x % 2
+
+    def window(it):
+        return zip(it, it)
+    sys.modules['empty23'] = imp.new_module('empty23')
+    metafunc('empty23.stream', [inc, double, declare(odd, stream='filter'),
+                                declare(window, stream='iter')],
+             [range], streaming=True)
+    from empty23.stream.inc.odd.double import range as f
+    rv = f(6)
+    assert iter(rv) is rv
+    assert list(rv) == [2, 6, 10]
+    import empty23
+    assert list(empty23.stream.double.window.range(4)) == [(0, 2), (4, 6)]
+    assert list(empty23.stream.range(3)) == [0, 1, 2]
+    assert empty23.stream.double._composition
+    rv = empty23.stream.inc.range(10 ** 9)
+    assert next(rv) == 1
+    metafunc('empty23.revstream', [inc, double], [range], streaming=True,
+             reverse=True, lazy=True)
+    assert list(empty23.revstream.inc.double.range(2)) == [1, 3]
+
+
+def test_pickle():
+    import pickle
+    sys.modules['empty24'] = imp.new_module('empty24')
+    metafunc('empty24.hofs', [doubled, tripled, identified], [one, two])
+    metafunc('empty24.comp', hofs1, [one, two], composition=True, lazy=True)
+    metafunc('empty24.comp2', hofs1, [one, two], composition=True)
+    import empty24
+    f = empty24.hofs.doubled.tripled.one
+    assert f.__module__ == 'empty24.hofs.doubled.tripled'
+    assert f.__qualname__ == 'one'
+    assert pickle.loads(pickle.dumps(f)) is f
+    f = empty24.comp.inc.double.two
+    assert pickle.loads(pickle.dumps(f)) is f
+    # each module has its own copy of a shared chain, with its own path
+    g = empty24.comp2.inc.double.two
+    assert shares(g, f) and g is not f
+    assert g.__module__ == 'empty24.comp2.inc.double'
+    assert pickle.loads(pickle.dumps(g)) is g
+    assert f.__module__ == 'empty24.comp.inc.double'
+    # first order functions and stages returned unchanged aren't modified
+    assert empty24.hofs.one is one
+    assert one.__module__ == 'zmm.firstorder'
+    registry = []
+
+    def register(f):
+        registry.append(f)
+        return f
+
+    def make():
+        def local_one():
+            return 1
+        return local_one
+    local_one = make()
+    nothing = declare(identified, identity=True)
+    metafunc('empty24.local', [register, ('nothing', nothing)],
+             [local_one, ('two', lambda: 2)])
+    assert empty24.local.register.local_one is local_one
+    assert empty24.local.register.local_one() == 1
+    assert empty24.local.nothing.local_one is local_one
+    assert registry[0] is local_one
+    assert local_one.__module__ == __name__
+    assert local_one.__qualname__ == (
+        'test_pickle.<locals>.make.<locals>.local_one')
+    assert empty24.local.nothing.register.two.__qualname__ == (
+        'test_pickle.<locals>.<lambda>')
+    # other callables are left as they are
+    import functools
+    partial = functools.partial(divmod, 7)
+    metafunc('empty24.partial', [('bind', lambda f: partial)], [one])
+    assert empty24.partial.bind.one is partial
+    assert empty24.partial.bind.one(2) == (3, 1)
+    data = pickle.dumps(empty24.comp.triple.inc.one)
+    del empty24.comp.triple.__dict__['inc']
+    del sys.modules['empty24.comp.triple.inc']
+    assert pickle.loads(data)() == 4
+    with forkpool(1) as executor:
+        assert executor.submit(empty24.hofs.tripled.doubled.two).result() == 12
+    # a chain shared by two roots pickles as the function of each
+    metafunc('empty24.ra', [doubled, tripled], [one])
+    metafunc('empty24.rb', [doubled, tripled], [one])
+    f = empty24.rb.doubled.tripled.one
+    assert shares(f, empty24.ra.doubled.tripled.one)
+    assert f.__module__ == 'empty24.rb.doubled.tripled'
+    unload('empty24.ra')
+    assert pickle.loads(pickle.dumps(f)) is f
+
+
+def test_prefetch():
+    import gc
+    from concurrent.futures import ThreadPoolExecutor
+    sys.modules['empty25'] = imp.new_module('empty25')
+    metafunc('empty25.comp', hofs1, [one, two], composition=True, lazy=True)
+    import empty25
+    modules = prefetch('empty25.comp', ['inc.d*'])
+    assert [m.__name__ for m in modules] == ['empty25.comp.inc',
+                                             'empty25.comp.inc.double']
+    assert 'one' in empty25.comp.inc.double.__dict__
+    assert 'triple' not in empty25.comp.__dict__
+    assert len(prefetch(empty25.comp, depth=2)) == 12
+    assert 'two' in empty25.comp.triple.triple.__dict__
+    assert raises(ValueError, lambda: prefetch('empty25.comp', ['inc.bad*']))
+    assert raises(ValueError, lambda: prefetch('empty25.comp', depth=1,
+                                               executor=object(),
+                                               freeze=True))
+    with ThreadPoolExecutor(3) as executor:
+        futures = prefetch('empty25.comp', ['*.*.inc'], executor=executor)
+        assert len(futures) == 3
+        assert sum(len(f.result()) for f in futures) == 3 + 9 + 9
+    assert 'one' in empty25.comp.double.triple.inc.__dict__
+    if hasattr(gc, 'freeze'):
+        try:
+            prefetch('empty25.comp', ['inc'], freeze=True)
+            assert gc.get_freeze_count() > 0
+        finally:
+            gc.unfreeze()
+
+
+def test_trie():
+    sys.modules['empty26'] = imp.new_module('empty26')
+    metafunc('empty26.comp', hofs1, [one, two], composition=True, lazy=True,
+             reverse=True)
+    import empty26
+    root = empty26.comp
+    node = root._node.child('inc', inc).child('double', double)
+    assert node.module is None
+    assert node.stages == (inc, double)
+    assert node.getchain(True) == (double, inc)
+    assert 'inc' not in vars(root)
+    assert [n.name for n in root._node.walk()] == [None, 'inc', 'double']
+    module = root.inc.double
+    assert module._node is node
+    assert node.module is module
+    assert module._source is root.inc
+    assert module._funcs is root._funcs
+    assert module._reverse and not module._isfirst and root._isfirst
+    assert module._chain == (double, inc)
+    assert module.one() == 3
+    for name in ['_funcs', '_reverse', '_stages', '_chain', '_source']:
+        assert name not in vars(module)
+    # options are read through descriptors of the class
+    assert type(module)._funcs is vars(type(module))['_funcs']
+
+
+def test_cached():
+    from metafunc.hofs import cached, cacheinfo
+    calls = []
+
+    def slow(x):
+        calls.append(x)
+        return x
+
+    sys.modules['empty27'] = imp.new_module('empty27')
+    metafunc('empty27.comp', [inc, double, cached], [slow], composition=True)
+    metafunc('empty27.hofs', [doubled, tripled, cached], [slow], lazy=True)
+    import empty27
+    f = empty27.comp.inc.cached.double.slow
+    assert f(1) == 4
+    assert f(1) == 4
+    assert calls == [1]
+    assert f.cache_info().hits == 1
+    # cached is idempotent, so the chain has a single cache
+    k = empty27.comp.cached.cached.slow
+    assert k(5) == 5
+    k.cache_clear()
+    assert k(5) == 5
+    assert calls == [1, 5, 5]
+    g = empty27.hofs.cached.doubled.tripled.slow
+    assert g(2) == 12
+    assert g(2) == 12
+    assert calls == [1, 5, 5, 2]
+    assert g.__module__ == 'empty27.hofs.cached.doubled.tripled'
+    assert empty27.hofs.doubled.tripled.cached.slow.cache_info().currsize == 0
+    assert cacheinfo(empty27.hofs.cached.doubled.tripled) == {
+        'slow': g.cache_info()}
+    assert empty27.hofs.doubled.slow(1) == 2
+    assert cacheinfo(empty27.hofs.doubled) == {}
+    # chains with unhashable stages aren't shared, but are still cached
+    metafunc('empty27.unhashable', [Unhashable(doubled), cached], [slow])
+    h = empty27.unhashable.cached.doubled.slow
+    assert h(3) == 6
+    assert h(3) == 6
+    assert calls == [1, 5, 5, 2, 1, 3]
+
+
+def test_evaluate():
+    calls = []
+
+    def counted(func):
+        def inner(x):
+            calls.append(func.__name__)
+            return func(x)
+        inner.__name__ = func.__name__
+        return inner
+
+    def base(x=1):
+        calls.append('base')
+        return x
+    c_inc, c_double, c_triple = map(counted, [inc, double, triple])
+    sys.modules['empty28'] = imp.new_module('empty28')
+    metafunc('empty28.comp', [c_inc, c_double, c_triple], [base, one],
+             composition=True, lazy=True)
+    metafunc('empty28.hofs', [doubled, tripled], [one], lazy=True)
+    import empty28
+    rv = evaluate('empty28.comp', ['inc.double.base', 'inc.triple.base',
+                                   'inc.double.inc.base', 'base'], x=2)
+    assert rv == {'inc.double.base': 6, 'inc.triple.base': 9,
+                  'inc.double.inc.base': 7, 'base': 2}
+    assert sorted(calls) == ['base', 'double', 'inc', 'inc', 'triple']
+    assert 'inc' not in vars(empty28.comp)
+    assert evaluate('empty28.comp', [['triple', 'one']]) == {
+        ('triple', 'one'): 3}
+    assert evaluate(empty28.hofs, ['doubled.tripled.one']) == {
+        'doubled.tripled.one': 6}
+    assert raises(ValueError, lambda: evaluate('empty28.comp', ['inc.bad']))
+    assert raises(ValueError, lambda: evaluate('empty28.comp', ['bad.one']))
+    assert raises(ValueError, lambda: evaluate('empty28.comp', ['']))
+    # functions are cached until functions change
+    del calls[:]
+    f = evaluator('empty28.comp', ['inc.base', 'inc.inc.base'])
+    assert f(3) == {'inc.base': 4, 'inc.inc.base': 5}
+    assert sorted(calls) == ['base', 'inc', 'inc']
+    assert len(empty28.comp._evaluators) == 2
+    evaluate('empty28.comp', ['inc.double.base', 'inc.triple.base',
+                              'inc.double.inc.base', 'base'], x=2)
+    assert len(empty28.comp._evaluators) == 2
+    addfuncs('empty28.comp', [('one', two)], replace=True)
+    assert evaluate('empty28.comp', [['triple', 'one']]) == {
+        ('triple', 'one'): 6}
+    assert len(empty28.comp._evaluators) == 3
+
+
+def test_unload():
+    import gc
+    import weakref
+    from metafunc import instrument
+    from metafunc.core import _loader
+
+    def tenant():
+        return 7
+    sys.modules['empty29'] = imp.new_module('empty29')
+    metafunc('empty29.comp', hofs1, [tenant, one], composition=True)
+    metafunc('empty29.inst', hofs1, [tenant], composition=True,
+             instrument=True)
+    metafunc('empty29.keep', hofs1, [one], composition=True)
+    import empty29
+    root = empty29.comp
+    sub = root.inc.double
+    assert sub.tenant() == 16
+    assert empty29.inst.inc.double.tenant() == 16
+    unload('empty29.inst.inc')
+    assert not any(item['module'] == 'empty29.inst.inc.double'
+                   for item in instrument.snapshot())
+    # unload a subtree
+    unload('empty29.comp.inc')
+    assert 'empty29.comp.inc' not in sys.modules
+    assert 'empty29.comp.inc.double' not in sys.modules
+    assert 'inc' not in vars(root)
+    assert 'inc' not in root._node.children
+    assert 'double' not in vars(sub)
+    assert 'empty29.comp.inc.double' not in _loader._modules
+    assert 'empty29.comp.inc.double' not in _loader._specs
+    from empty29.comp.inc.double import tenant as f
+    assert f() == 16
+    assert empty29.comp.inc.double is not sub
+    # unload the root
+    assert any(unwrap_key(key) is tenant for key in chaincache._data)
+    ref = weakref.ref(root)
+    del root, sub, f
+    unload(empty29.comp)
+    assert not hasattr(empty29, 'comp')
+    assert not [name for name in sys.modules
+                if name.startswith('empty29.comp')]
+    assert not [name for name in _loader._modules
+                if name.startswith('empty29.comp')]
+    # still used by empty29.inst
+    assert any(unwrap_key(key) is tenant for key in chaincache._data)
+    unload('empty29.inst')
+    assert not any(unwrap_key(key) is tenant for key in chaincache._data)
+    # first order functions of other roots are kept
+    assert any(unwrap_key(key) is one for key in chaincache._data)
+    gc.collect()
+    assert ref() is None
+    assert raises(ValueError, lambda: unload('empty29.comp'))
+    # hidden roots
+    metafunc('empty29', [inc, double], [tenant], composition=True)
+    assert empty29.inc.tenant() == 8
+    stale = empty29.inc
+    assert empty29.inc.double.tenant() == 16
+    unload('empty29.inc')
+    assert empty29.inc is not stale
+    assert sys.modules['empty29.inc'] is empty29.inc
+    assert 'empty29.inc.double' not in sys.modules
+    from empty29.inc.double import tenant as f
+    assert f() == 16
+    unload('empty29')
+    assert not hasattr(empty29, 'inc')
+    assert not hasattr(empty29, '_hidden_metamodule_')
+    assert 'empty29.inc' not in sys.modules
+    assert sys.modules['empty29'] is empty29
+    # modules that share a name are unregistered separately
+    loader = ModuleLoader()
+    first = imp.new_module('empty29.shared')
+    second = imp.new_module('empty29.shared')
+    loader.register(first)
+    loader.register(second)
+    loader.unregister(first)
+    assert loader.lookup('empty29.shared') is second
+    loader.unregister(second)
+    assert loader.lookup('empty29.shared') is None
+
+    # the loader is removed once no MetaModules are left
+    def last():
+        return 0
+
+    modules = _loader._modules
+    _loader._modules = {}
+    try:
+        metafunc('empty29.last', [inc], [last], composition=True)
+        assert _loader in sys.meta_path
+        assert empty29.last.inc.last() == 1
+        unload('empty29.last')
+        assert _loader not in sys.meta_path
+    finally:
+        _loader._modules = modules
+        if _loader not in sys.meta_path:
+            sys.meta_path.append(_loader)
+
+
+def unwrap_key(key):
+    return getattr(key[0], 'func', key[0])
+
+
+def test_resolve():
+    import pickle
+    sys.modules['empty30'] = imp.new_module('empty30')
+    metafunc('empty30.hofs', [doubled, tripled], [one, two], lazy=True)
+    metafunc('empty30.comp', hofs1, [one, two], composition=True, lazy=True,
+             instrument=True)
+    import empty30
+    f = resolve('empty30.hofs.doubled.tripled.one')
+    assert f() == 6
+    assert 'empty30.hofs.doubled' not in sys.modules
+    assert 'doubled' not in vars(empty30.hofs)
+    assert resolvecache.get('empty30.hofs.doubled.tripled.one')[0] is f
+    assert resolve('empty30.hofs.doubled.tripled.one') is f
+    assert resolve('empty30.hofs.one') is one
+    # pickling imports the chain, which shares the function
+    assert pickle.loads(pickle.dumps(f)) is f
+    assert empty30.hofs.doubled.tripled.one is f
+    assert resolve('empty30.hofs.doubled.tripled.one') is f
+    # starts from the closest existing module
+    assert resolve('empty30.hofs.doubled.two')() == 4
+    addfuncs('empty30.hofs', [('one', two)], replace=True)
+    assert resolve('empty30.hofs.doubled.tripled.one')() == 12
+    # instrumented chains are built by their module
+    assert resolve('empty30.comp.inc.one')() == 2
+    assert 'empty30.comp.inc' in sys.modules
+    assert raises(ValueError, lambda: resolve('empty30.hofs.doubled.bad'))
+    assert raises(ValueError, lambda: resolve('empty30.hofs.bad.one'))
+    assert raises(ValueError, lambda: resolve('empty30.nothing.one'))
+    assert raises(ValueError, lambda: resolve('one'))
+    unload('empty30.hofs')
+    assert len(resolvecache) == 0
+    assert raises(ValueError, lambda: resolve('empty30.hofs.one'))
+
+
+def test_operational_hofs():
+    from metafunc.hofs import batched, pmap, ratelimit, timed, timeout
+    sizes = []
+
+    def score(items):
+        sizes.append(len(items))
+        return [item + 1 for item in items]
+
+    sys.modules['empty31'] = imp.new_module('empty31')
+    metafunc('empty31.svc', [timed, batched, pmap, ratelimit(1000),
+                             timeout(5)], [score], lazy=True)
+    metafunc('empty31.comp', [timed, inc, pmap], [identity], composition=True)
+    import empty31
+    from empty31.svc.timed.batched.pmap import score as f
+    assert f([1, 2, 3]) == [2, 3, 4]
+    assert sum(sizes) == 3
+    assert f.__module__ == 'empty31.svc.timed.batched.pmap'
+    g = empty31.svc.ratelimited.deadline.score
+    assert g([1]) == [2]
+    g = empty31.comp.pmap.inc.timed.identity
+    assert g([1, 2]) == [2, 3]
+
+
+def test_process_pool():
+    # chains sent to a process pool are pickled by their path
+    from metafunc.hofs import parallel, pmap, timed, timeout
+    sys.modules['empty34'] = imp.new_module('empty34')
+    with forkpool(2) as executor:
+        ppmap = parallel(executor, name='ppmap')
+        metafunc('empty34.hofs', [ppmap, doubled, timeout(5, executor)],
+                 [inc], lazy=True)
+        metafunc('empty34.comp', [double, ppmap, timed, inc], [identity],
+                 composition=True, lazy=True)
+        import empty34
+        assert empty34.hofs.doubled.ppmap.inc([1, 2, 3]) == [4, 6, 8]
+        assert empty34.hofs.deadline.doubled.inc(1) == 4
+        assert empty34.comp.timed.double.ppmap.inc.identity([1, 2]) == [3, 5]
+    # the function given to an outer stage is the chain without it
+    import pickle
+    from metafunc.core import chainrefs
+    from metafunc.hofs import _Call
+    metafunc('empty34.rev', [pmap, doubled, tripled], [inc], reverse=True,
+             instrument=True)
+    assert empty34.rev.doubled.pmap.tripled.inc([0, 1]) == [6, 12]
+    paths = dict((path, func) for func, path in chainrefs.items())
+    func = paths['empty34.rev.doubled.tripled.inc']
+    call = pickle.loads(pickle.dumps(_Call(func, (), {})))
+    assert call.func is not func
+    assert call(1) == 12
+
+
+def test_flattened():
+    fdoubled = declare(doubled, result=lambda x: 2 * x)
+    ftripled = declare(tripled, result=lambda x: 3 * x)
+    fincremented = declare(incremented, result=lambda x: x + 1)
+
+    def negated(f):
+        def inner(*args, **kwargs):
+            return f(*(-arg for arg in args), **kwargs)
+        return inner
+    fnegated = declare(negated, args=lambda args, kwargs: (
+        tuple(-arg for arg in args), kwargs))
+
+    sys.modules['empty32'] = imp.new_module('empty32')
+    metafunc('empty32.hofs', [fdoubled, ftripled, fincremented, identified,
+                              fnegated], [one, inc], lazy=True)
+    import empty32
+    module = empty32.hofs
+    f = module.doubled.tripled.incremented.one
+    assert f() == 7
+    # a single wrapper around the first order function
+    assert f.__wrapped__ is one
+    assert f.__module__ == 'empty32.hofs.doubled.tripled.incremented'
+    g = module.doubled.identified.tripled.incremented.one
+    assert g() == 7
+    assert g.__wrapped__ is not one
+    assert module.doubled.tripled.one() == 6
+    # cached prefixes would split the run, so it's built as one wrapper
+    h = module.doubled.tripled.incremented.doubled.one
+    assert h() == 14
+    assert h.__wrapped__ is one
+    assert module.negated.doubled.inc(3) == -4
+    assert module.doubled.negated.inc(3) == -4
+    assert module.negated.identified.inc(3) == -2
+    assert module.incremented.negated.negated.inc(3) == 5
+    assert module.identified.negated.doubled.inc.__wrapped__ is not inc
+
+
+def test_template():
+    template = Template([inc, double, triple], [one, two, identity],
+                        composition=True)
+    assert template.prebuild(['inc']) == 3
+    assert len(template._chains) == 3
+    sys.modules['empty33'] = imp.new_module('empty33')
+    first = template.instantiate('empty33.first')
+    second = template.instantiate('empty33.second',
+                                  funcs=[('two', three)])
+    import empty33
+    assert empty33.first is first
+    # tables are shared, not copied
+    assert first._funcs.maps[1] is template._funcs
+    assert first._metafuncs.maps[1] is template._metafuncs
+    assert 'inc' not in first.__dict__
+    f = empty33.first.inc.double.one
+    assert f() == 4
+    assert shares(empty33.second.inc.double.one, f)
+    assert shares(empty33.first.inc.one,
+                  template._chains.get(('one', (inc,), ())))
+    assert empty33.first.inc.two() == 3
+    assert empty33.second.inc.two() == 4
+    assert empty33.second.two is three
+    # overrides are copied on write
+    addfuncs(first, [('two', one)], replace=True)
+    assert empty33.first.inc.two() == 2
+    assert empty33.second.inc.two() == 4
+    assert template._funcs['two'] is two
+    addmetafuncs(second, [('incremented', incremented)])
+    assert 'incremented' not in template._metafuncs
+    assert raises(AttributeError, lambda: empty33.first.incremented)
+    third = template.instantiate('empty33.third', metafuncs={'inc': double})
+    assert third.inc.one() == 2
+    assert shares(third.double.one, empty33.first.double.one)
+    assert raises(ValueError, lambda: template.instantiate(
+        'empty33.fourth', funcs={'inc': one}))
+    assert raises(ValueError, lambda: template.instantiate(
+        'empty33.fourth', metafuncs={'one': inc}))
+    assert raises(ValueError, lambda: Template([one], [one]))
+    assert 'fourth' not in empty33.__dict__
+    unload(first)
+    assert 'empty33.first.inc' not in sys.modules
+    assert shares(empty33.second.inc.double.one, f)
+    # overrides come first
+    assert sorted(second._funcs) == ['identity', 'one', 'two']
+    assert len(second._funcs) == 3
+    assert second._funcs.get('two') is three
+    assert second._funcs.get('three') is None
+    assert sorted(second._funcs.keys()) == ['identity', 'one', 'two']
+    assert three in second._funcs.values()
+    assert ('two', three) in second._funcs.items()
+    assert ('two', two) not in second._funcs.items()
+    assert template._chains.maxsize == 4096
+
+
+def test_template_unhashable():
+    # chains with unhashable metafuncs are built but not kept
+    template = Template([Unhashable(doubled)], [one])
+    sys.modules['empty35'] = imp.new_module('empty35')
+    root = template.instantiate('empty35.root')
+    assert root.doubled.one() == 2
+    assert root.doubled.doubled.one() == 4
+    assert len(template._chains) == 0
+
+
+def test_template_outer():
+    # chains with outer stages are built by each root, with its own paths
+    from metafunc.core import chainrefs
+    from metafunc.hofs import parallel
+    sys.modules['empty36'] = imp.new_module('empty36')
+    with forkpool(2) as executor:
+        template = Template([parallel(executor, name='ppmap'), doubled],
+                            [identity])
+        assert template.prebuild(depth=2) == 2
+        first = template.instantiate('empty36.first')
+        second = template.instantiate('empty36.second')
+        assert first.ppmap.doubled.identity([1, 2, 3]) == [2, 4, 6]
+        assert second.ppmap.doubled.identity([1, 2, 3]) == [2, 4, 6]
+    assert first.doubled.identity(2) == 4
+    paths = set(chainrefs.values())
+    assert 'empty36.first.doubled.identity' in paths
+    assert 'empty36.second.doubled.identity' in paths
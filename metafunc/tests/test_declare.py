@@ -0,0 +1,82 @@
+from metafunc.declare import (declare, getprops, simplify, streamkinds,
+                              transforms, unwrap, Declared)
+from metafunc.utils import raises
+from zmm.firstorder import inc, double, triple, identity
+
+
+def dec(x):
+    return x - 1
+
+
+def neg(x):
+    return -x
+
+
+def test_declare():
+    d = declare(inc, commutative='add')
+    assert isinstance(d, Declared)
+    assert d(1) == 2
+    assert d.__name__ == 'inc'
+    assert unwrap(d) is inc
+    assert unwrap(inc) is inc
+    assert getprops(d) == {'commutative': 'add'}
+    assert getprops(inc) == {}
+    d2 = declare(d, inverse=declare(dec))
+    assert unwrap(d2) is inc
+    assert getprops(d2) == {'commutative': 'add', 'inverse': dec}
+    assert "commutative='add'" in repr(d2)
+    assert raises(ValueError, lambda: declare(inc, commutative=True))
+    assert raises(TypeError, lambda: declare(inc, foo=True))
+    assert raises(ValueError, lambda: declare(inc, stream='reduce'))
+    assert raises(TypeError, lambda: declare(inc, result=1))
+    assert transforms(inc) is None
+    assert transforms(d) is None
+    assert transforms(declare(inc, result=double)) == (None, double)
+    assert streamkinds([inc, declare(inc, stream='filter')]) == ['map',
+                                                                 'filter']
+
+    @declare(idempotent=True)
+    def absolute(x):
+        return abs(x)
+    assert getprops(absolute) == {'idempotent': True}
+    assert absolute(-1) == 1
+
+
+def test_simplify():
+    stages = (inc, double, inc)
+    assert simplify(stages) is stages
+    ident = declare(identity, identity=True)
+    assert simplify((ident, inc, ident)) == (inc,)
+    idem = declare(abs, idempotent=True)
+    assert simplify((idem, idem, inc, idem)) == (idem, inc, idem)
+    dinc = declare(inc, inverse=dec)
+    ddec = declare(dec)
+    assert simplify((dinc, ddec, double)) == (double,)
+    assert ddec(dinc(1)) == 1
+    assert simplify((ddec, dinc, dinc)) == (dinc,)
+    dneg = declare(neg, inverse=neg)
+    assert simplify((dneg, dneg, dneg)) == (dneg,)
+    assert dneg(dneg(2)) == 2
+    assert simplify((dneg, double, dneg)) == (dneg, double, dneg)
+
+
+def test_commutative_and_fuse():
+    cinc = declare(inc, commutative='add', fuse=lambda k: lambda x: x + k)
+    cdouble = declare(double, commutative='mul')
+    ctriple = declare(triple, commutative='mul')
+    assert (simplify((ctriple, cdouble, inc, cdouble, ctriple)) ==
+            simplify((cdouble, ctriple, inc, ctriple, cdouble)))
+    stages = simplify((cinc, cinc, cinc, cinc))
+    assert len(stages) == 1
+    assert stages[0](0) == 4
+    assert simplify((cinc,) * 4) == stages
+    # stages of different groups don't commute
+    assert simplify((cinc, cdouble)) == (cinc, cdouble)
+    assert simplify((cdouble, cinc)) == (cdouble, cinc)
+    cdec = declare(dec, commutative='add', inverse=inc)
+    assert simplify((cinc, ctriple, cdec)) == (cinc, ctriple, cdec)
+    # inverse across a run of the same group cancels
+    cadd2 = declare(lambda x: x + 2, commutative='add')
+    assert simplify((cinc, cadd2, cdec)) == (cadd2,)
+    fused = simplify((cinc, cinc, cinc, cdec))
+    assert len(fused) == 1 and fused[0](0) == 2
@@ -0,0 +1,166 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metafunc.hofs import (DeadlineExceeded, Histogram, RateLimitExceeded,
+                           TokenBucket, batched, batching, cached, memoize,
+                           parallel, pmap, ratelimit, timed, timeout)
+from metafunc.declare import getprops, unwrap
+from metafunc.utils import raises
+
+
+def counter():
+    calls = []
+
+    def func(*args, **kwargs):
+        calls.append(args)
+        return len(calls)
+    return func, calls
+
+
+def test_memoize():
+    func, calls = counter()
+    f = unwrap(cached)(func)
+    assert f(1) == 1
+    assert f(1) == 1
+    assert f(2) == 2
+    assert f(1, x=2) == 3
+    assert f(1, x=2) == 3
+    assert f.cache_info() == (2, 3, 128, 3)
+    assert f([]) == 4
+    assert f([]) == 5
+    assert f(1.0) == 1
+    f.cache_clear()
+    assert f(1) == 6
+    assert getprops(cached)['outer']
+    assert cached.__name__ == 'cached'
+
+
+def test_memoize_options():
+    func, calls = counter()
+    f = unwrap(memoize(maxsize=1, typed=True, name='typed'))(func)
+    assert f(1) == 1
+    assert f(1.0) == 2
+    assert f(1) == 3
+    assert f(1, x=1) == 4
+    assert f(1, x=1.0) == 5
+    g = unwrap(memoize(ttl=60))(counter()[0])
+    assert g(1) == g(1)
+    g = unwrap(memoize(ttl=0))(counter()[0])
+    assert g(1) != g(1)
+
+
+def test_pmap():
+    f = unwrap(pmap)(lambda x, y=0: x * 2 + y)
+    assert f(range(5)) == [0, 2, 4, 6, 8]
+    assert f([1, 2], y=1) == [3, 5]
+    assert f([1, 2], 10) == [12, 14]
+    assert f([]) == []
+    assert getprops(pmap)['outer']
+    assert pmap.__name__ == 'pmap'
+    g = unwrap(parallel('process', name='ppmap'))(abs)
+    assert g([-1, 2, -3]) == [1, 2, 3]
+    with ThreadPoolExecutor(2) as executor:
+        h = unwrap(parallel(executor))(lambda x: threading.current_thread())
+        assert len(set(h(range(8)))) <= 2
+
+    def fail(x):
+        raise KeyError(x)
+    assert raises(KeyError, lambda: unwrap(pmap)(fail)([1]))
+    assert raises(ValueError, lambda: parallel('fiber'))
+
+
+def test_batched():
+    calls = []
+
+    def bulk(items):
+        calls.append(list(items))
+        return [item * 10 for item in items]
+    f = unwrap(batching(maxsize=4, delay=0.05))(bulk)
+    assert f(1) == 10
+    assert calls == [[1]]
+    del calls[:]
+    results = {}
+    barrier = threading.Barrier(10)
+
+    def worker(i):
+        barrier.wait()
+        results[i] = f(i)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == dict((i, i * 10) for i in range(10))
+    assert sorted(sum(calls, [])) == list(range(10))
+    assert all(len(items) <= 4 for items in calls)
+    assert len(calls) < 10
+    assert f.batcher.batches == len(calls) + 1
+    assert batched.__name__ == 'batched'
+
+    g = unwrap(batched)(lambda items: [])
+    assert raises(ValueError, lambda: g(1))
+    assert raises(ValueError, lambda: batching(maxsize=0))
+
+
+def test_timed():
+    f = unwrap(timed)(lambda x: time.sleep(x) or x)
+    assert f(0) == 0
+    assert f(0.02) == 0.02
+    snapshot = f.histogram.snapshot()
+    assert snapshot['count'] == 2
+    assert snapshot['sum'] >= 0.02
+    assert snapshot['buckets'][-1] == (float('inf'), 2)
+    assert dict(snapshot['buckets'])[0.01] == 1
+    # calls that raise are timed too
+    assert raises(ValueError, lambda: f(-1))
+    assert f.histogram.count == 3
+    h = Histogram([2, 1])
+    h.observe(1)
+    h.observe(1.5)
+    h.observe(3)
+    assert h.buckets == (1, 2)
+    assert h.counts == [1, 1, 1]
+    assert h.snapshot()['buckets'] == [(1, 1), (2, 2), (float('inf'), 3)]
+    h.reset()
+    assert h.count == 0
+
+
+def test_ratelimit():
+    now = [0.0]
+    bucket = TokenBucket(2, burst=2, clock=lambda: now[0])
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == 0.5
+    now[0] = 0.25
+    assert bucket.take() == 0.25
+    now[0] = 10
+    assert bucket.take() == 0
+    assert bucket.tokens == 1
+    f = unwrap(ratelimit(1, block=False))(lambda: 1)
+    assert f() == 1
+    assert raises(RateLimitExceeded, lambda: f())
+    g = unwrap(ratelimit(50, burst=1))(lambda: 1)
+    start = time.time()
+    assert [g(), g(), g()] == [1, 1, 1]
+    assert time.time() - start >= 0.03
+    shared = ratelimit(1, block=False, shared=True)
+    unwrap(shared)(lambda: 1)()
+    assert raises(RateLimitExceeded, lambda: unwrap(shared)(lambda: 2)())
+    assert raises(ValueError, lambda: ratelimit(0))
+
+
+def test_timeout():
+    limiter = timeout(0.05)
+    assert limiter.__name__ == 'deadline'
+    f = unwrap(limiter)(lambda x: time.sleep(x) or x)
+    assert f(0) == 0
+    assert raises(DeadlineExceeded, lambda: f(0.5))
+    if sys.version_info >= (3, 3):
+        assert raises(TimeoutError, lambda: f(0.5))
+
+    def fail():
+        raise KeyError
+    assert raises(KeyError, lambda: unwrap(limiter)(fail)())
+    assert raises(ValueError, lambda: timeout(0))
@@ -0,0 +1,101 @@
+import json
+from metafunc import instrument
+from metafunc.declare import declare
+from metafunc.utils import raises
+from zmm import coroutines
+from zmm.firstorder import one, inc, double, identity
+from zmm.higherorder import doubled, tripled
+
+
+def test_composition():
+    f = instrument.build('test.comp.inc.double', 'one', one, (inc, double),
+                         composition=True)
+    assert f() == 4
+    assert f() == 4
+    stats = [item for item in instrument.snapshot()
+             if item['module'] == 'test.comp.inc.double']
+    assert len(stats) == 1
+    assert stats[0]['calls'] == 2
+    assert [name for name, seconds in stats[0]['stages']] == ['one', 'inc',
+                                                              'double']
+    assert stats[0]['seconds'] >= sum(s for n, s in stats[0]['stages']) * 0.5
+    instrument.reset()
+    stats = [item for item in instrument.snapshot()
+             if item['module'] == 'test.comp.inc.double']
+    assert stats[0]['calls'] == 0
+    g = instrument.build('test.comp.inc.double', 'identity', identity,
+                         (inc, double), composition=True)
+    assert g.batch([1, 2]) == [4, 6]
+
+
+def fail(x):
+    raise ZeroDivisionError
+
+
+def test_errors():
+    # calls that raise are recorded in every mode
+    f = instrument.build('test.errors.fail', 'one', one, (inc, fail),
+                         composition=True)
+    g = instrument.build('test.errors.failed', 'one', fail, (doubled,))
+    assert raises(ZeroDivisionError, f)
+    assert raises(ZeroDivisionError, lambda: g(1))
+    assert instrument.getstats('test.errors.fail', 'one',
+                               (one, inc, fail)).calls == 1
+    assert instrument.getstats('test.errors.failed', 'one',
+                               (fail, doubled)).calls == 1
+
+
+def test_hof():
+    f = instrument.build('test.hofs.doubled.tripled', 'one', one,
+                         (doubled, tripled))
+    assert f() == 6
+    assert f.__name__ == 'one'
+    stats = instrument.getstats('test.hofs.doubled.tripled', 'one',
+                                (one, doubled, tripled))
+    assert stats.calls == 1
+    assert stats.stages[2] >= stats.stages[0]
+
+
+def test_export():
+    f = instrument.build('test.export."x"', 'one', one, (inc,),
+                         composition=True)
+    f()
+    data = json.loads(instrument.tojson())
+    assert any(item['module'] == 'test.export."x"' for item in data)
+    text = instrument.toprometheus()
+    assert '# TYPE metafunc_calls_total counter' in text
+    assert ('metafunc_calls_total{module="test.export.\\"x\\"",'
+            'function="one"} 1') in text
+    assert 'stage="inc",position="1"' in text
+    assert instrument.toprometheus([]).count('\n') == 6
+
+
+def test_streaming():
+    f = instrument.build('test.stream.inc.sorted', 'range', range,
+                         (inc, declare(sorted, stream='iter')),
+                         composition=True, streaming=True)
+    rv = f(3)
+    stats = instrument.getstats('test.stream.inc.sorted', 'range',
+                                (range, inc, sorted))
+    assert stats.calls == 1
+    assert rv == [1, 2, 3]
+    assert stats.names == ['range', 'inc', 'sorted']
+
+
+def test_async():
+    if not coroutines.supported:  # pragma: no cover
+        return
+    aone = coroutines.aone
+    afail = coroutines.afail
+    f = instrument.build('test.async.inc.double', 'aone', aone,
+                         (inc, declare(double, blocking=True)),
+                         composition=True)
+    assert coroutines.run(f()) == 4
+    stats = instrument.getstats('test.async.inc.double', 'aone',
+                                (aone, inc, double))
+    assert stats.calls == 1
+    g = instrument.build('test.async.afail', 'aone', aone, (afail,),
+                         composition=True)
+    assert raises(ZeroDivisionError, lambda: coroutines.run(g()))
+    assert instrument.getstats('test.async.afail', 'aone',
+                               (aone, afail)).calls == 1
@@ -0,0 +1,131 @@
+import imp
+import importlib
+import random
+import sys
+import threading
+from metafunc.core import metafunc, addfuncs, MetaModule
+from zmm.firstorder import one, two, three, inc, double, triple, identity
+
+
+fofs = [one, two, three, identity]
+hofs = [inc, double, triple]
+values = {'one': 1, 'two': 2, 'three': 3}
+
+
+def expected(path, funcname):
+    rv = values[funcname]
+    for name in path:
+        rv = {'inc': rv + 1, 'double': 2 * rv, 'triple': 3 * rv}[name]
+    return rv
+
+
+def hammer(roots, seed, nloops, errors, start):
+    rand = random.Random(seed)
+    start.wait()
+    try:
+        for _ in range(nloops):
+            root = rand.choice(roots)
+            path = [rand.choice(['inc', 'double', 'triple'])
+                    for _ in range(rand.randint(1, 4))]
+            funcname = rand.choice(sorted(values))
+            if rand.random() < 0.5:
+                module = importlib.import_module('.'.join([root] + path))
+            else:
+                module = sys.modules[root]
+                for name in path:
+                    module = getattr(module, name)
+            assert getattr(module, funcname)() == expected(path, funcname)
+    except Exception as exc:  # pragma: no cover
+        errors.append(exc)
+
+
+def adder(root, nfuncs, errors, start):
+    start.wait()
+    try:
+        for i in range(nfuncs):
+            def func(i=i):
+                return 100 + i
+            func.__name__ = 'f%d' % i
+            addfuncs(root, func)
+            module = sys.modules[root].double.triple
+            assert getattr(module, func.__name__)() == 6 * (100 + i)
+    except Exception as exc:  # pragma: no cover
+        errors.append(exc)
+
+
+def check_unique(root):
+    # every chain module in sys.modules is the one reached by attributes
+    for fullname, module in list(sys.modules.items()):
+        if not fullname.startswith(root + '.'):
+            continue
+        assert isinstance(module, MetaModule)
+        attr = sys.modules[root]
+        for name in fullname[len(root) + 1:].split('.'):
+            attr = getattr(attr, name)
+        assert attr is module
+
+
+def switch_often():
+    # switch threads as often as possible to expose races, and return a
+    # function that restores the previous setting
+    if not hasattr(sys, 'setswitchinterval'):  # pragma: no cover
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        return lambda: sys.setcheckinterval(interval)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    return lambda: sys.setswitchinterval(interval)
+
+
+def test_concurrent_imports():
+    sys.modules['threads1'] = imp.new_module('threads1')
+    roots = ['threads1.lazy', 'threads1.eager', 'threads1.compiled']
+    metafunc(roots[0], hofs, fofs, composition=True, lazy=True)
+    metafunc(roots[1], hofs, fofs, composition=True)
+    metafunc(roots[2], hofs, fofs, composition=True, lazy=True,
+             compiled=True)
+    nthreads = 16
+    errors = []
+    # released once every thread is running
+    start = threading.Event()
+    threads = [threading.Thread(target=hammer,
+                                args=(roots, i, 200, errors, start))
+               for i in range(nthreads)]
+    threads.append(threading.Thread(target=adder,
+                                    args=(roots[0], 30, errors, start)))
+    threads.append(threading.Thread(target=adder,
+                                    args=(roots[1], 30, errors, start)))
+    restore = switch_often()
+    try:
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        restore()
+    assert errors == []
+    for root in roots:
+        check_unique(root)
+
+
+def test_registered_before_published():
+    # other threads may import the children of a module as soon as it is
+    # in sys.modules, so the loader must already know it
+    from metafunc.core import _loader
+    published = []
+    register = _loader.register
+
+    def checked(module):
+        published.append(module.__name__ in sys.modules)
+        register(module)
+
+    sys.modules['threads2'] = imp.new_module('threads2')
+    _loader.register = checked
+    try:
+        metafunc('threads2.root', hofs, fofs, composition=True)
+        import threads2.root.inc.double
+    finally:
+        del _loader.register
+    assert threads2.root.inc.double.one() == 4
+    assert len(published) == 5 and not any(published)
@@ -0,0 +1,34 @@
+""" Coroutine functions for the tests
+
+"async def" is a syntax error before Python 3.5, so the functions are
+compiled at runtime, and ``supported`` is False where they don't exist.
+"""
+import sys
+
+supported = sys.version_info >= (3, 5)
+
+_source = """
+async def aone():
+    return 1
+
+
+async def adouble(x):
+    return 2 * x
+
+
+async def afail(x):
+    raise ZeroDivisionError
+"""
+
+if supported:
+    exec(compile(_source, __file__, 'exec'))
+
+
+def run(coroutine):
+    """ Run a coroutine to completion in a new event loop"""
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()